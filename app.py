@@ -1,9 +1,27 @@
-import sys, os, importlib
+import sys, os, re, time, importlib
+STARTUP_T0 = time.perf_counter()
 from PySide6.QtWidgets import (
     QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
     QListWidget, QStackedWidget, QLabel, QListWidgetItem, QComboBox, QDockWidget
 )
-from PySide6.QtCore import Qt
+from PySide6.QtCore import Qt, QTimer, Signal
+from tools.job_manager import JobWorker, JobPanel, get_job_manager, PRIORITY_LOW, STATE_QUEUED, LANE_WARMUP
+from tools.perf import PerfPanel, metrics
+
+# Tool modules (and pandas, OpenCV, requests with them) are imported on first use, not at startup.
+# Set WORKBENCH_PRELOAD_TOOLS=0 to skip importing them in the background once the window is shown.
+PRELOAD_TOOLS = os.environ.get("WORKBENCH_PRELOAD_TOOLS", "1") != "0"
+TOOL_MAP = {
+    "Affiliate_data": "联盟数据", "image_processor": "图片批量处理器",
+    "Translator": "文案优化", "AI_Chat": "AI聊天"
+}
+
+# Ollama keep_alive: seconds (-1 keeps the model loaded) or a duration such as 10m / 1h30m
+KEEP_ALIVE_PATTERN = re.compile(r"^(-?\d+|(\d+(\.\d+)?(ms|s|m|h))+)$")
+
+def log_timing(label, seconds):
+    print(f"[startup] {label}: {seconds * 1000:.0f} ms", flush=True)
+    metrics.observe(f"startup.{label}", seconds)
 
 STYLESHEET = """
 #ToolPanel {
@@ -32,6 +50,40 @@ QProgressBar::chunk { background-color: #be185d; }
 QGroupBox { font-weight: bold; }
 """
 
+class WarmupWorker(JobWorker):
+    finished = Signal(str, float)
+    error = Signal(str, str)
+
+    def __init__(self, model, keep_alive):
+        super().__init__()
+        self.model = model
+        self.keep_alive = keep_alive
+
+    def run(self):
+        try:
+            from tools.llm_client import get_client
+            self.finished.emit(self.model, get_client().warm_up(self.model, keep_alive=self.keep_alive))
+        except Exception as e: self.error.emit(self.model, str(e))
+
+class ToolPreloader(JobWorker):
+    """Imports tool modules off the GUI thread; widgets are still built on first selection."""
+    finished = Signal(dict)
+
+    def __init__(self, module_paths):
+        super().__init__()
+        self.module_paths = module_paths
+
+    def run(self):
+        timings = {}
+        for i, module_path in enumerate(self.module_paths):
+            if self.is_cancelled(): break
+            self.report(i, len(self.module_paths))
+            started = time.perf_counter()
+            try: importlib.import_module(module_path)
+            except Exception: continue
+            timings[module_path] = time.perf_counter() - started
+        self.finished.emit(timings)
+
 class MainWindow(QMainWindow):
     def __init__(self):
         super().__init__()
@@ -55,7 +107,25 @@ class MainWindow(QMainWindow):
         sidebar_layout.addWidget(QLabel("🧠 AI模型选择:"))
         self.model_selector = QComboBox()
         self.model_selector.addItems(["mulebuy-optimizer", "llama3.1:latest", "qwen3:8b", "gemma3:4b", "gpt-oss:20b"])
+        self.model_selector.currentTextChanged.connect(self.warm_up_model)
         sidebar_layout.addWidget(self.model_selector)
+        self.model_status_label = QLabel()
+        self.model_status_label.setWordWrap(True)
+        sidebar_layout.addWidget(self.model_status_label)
+
+        keep_alive_layout = QHBoxLayout()
+        keep_alive_layout.addWidget(QLabel("保持加载:"))
+        self.keep_alive_selector = QComboBox()
+        self.keep_alive_selector.setEditable(True)
+        self.keep_alive_selector.setInsertPolicy(QComboBox.NoInsert)
+        self.keep_alive_selector.addItems(["5m", "30m", "2h", "-1"])
+        self.keep_alive_selector.setCurrentText("30m")
+        self.keep_alive_text = "30m"  # last applied value; edits only take effect once confirmed
+        self.keep_alive_selector.setToolTip("Ollama keep_alive: 模型在最后一次请求后保持加载的时长，-1 表示一直保持。")
+        self.keep_alive_selector.activated.connect(lambda _: self.apply_keep_alive())
+        self.keep_alive_selector.lineEdit().editingFinished.connect(self.apply_keep_alive)
+        keep_alive_layout.addWidget(self.keep_alive_selector, 1)
+        sidebar_layout.addLayout(keep_alive_layout)
         sidebar_layout.addSpacing(10)
 
         self.tool_list = QListWidget()
@@ -69,43 +139,147 @@ class MainWindow(QMainWindow):
         self.stack = QStackedWidget()
         self.setCentralWidget(self.stack)
 
+        # --- Jobs panel: every background job of every tool goes through the shared JobManager ---
+        self.job_manager = get_job_manager()
+        jobs_dock = QDockWidget("后台任务", self)
+        jobs_dock.setWidget(JobPanel(self.job_manager))
+        self.addDockWidget(Qt.BottomDockWidgetArea, jobs_dock)
+        # --- Perf panel: span latencies and counters from every tool, also written to perf_metrics.jsonl ---
+        perf_dock = QDockWidget("性能", self)
+        perf_dock.setWidget(PerfPanel())
+        self.addDockWidget(Qt.BottomDockWidgetArea, perf_dock)
+        self.tabifyDockWidget(jobs_dock, perf_dock)
+        jobs_dock.raise_()
+
+        self.tool_widgets = {}  # row -> built tool widget
+        self.warmup_jobs = {}  # model -> latest warm-up job
         self.load_tools()
+        self.warm_up_model(self.model_selector.currentText())
+
+        # Per-model latency of the shared LLM client, shown as the status label's tooltip
+        self.metrics_timer = QTimer(self)
+        self.metrics_timer.timeout.connect(self.update_model_metrics)
+        self.metrics_timer.start(5000)
 
     def load_tools(self):
         tools_dir = "tools"
-        tool_map = {
-            "Affiliate_data": "联盟数据", "image_processor": "图片批量处理器",
-            "Translator": "文案优化", "AI_Chat": "AI聊天"
-        }
-        available_tools = sorted([d for d in os.listdir(tools_dir) if d in tool_map and os.path.isdir(os.path.join(tools_dir, d))])
+        available_tools = sorted([d for d in os.listdir(tools_dir) if d in TOOL_MAP and os.path.isdir(os.path.join(tools_dir, d))])
 
+        # Every tool starts as a placeholder page; the real widget is built the first time it is selected
         for tool_name in available_tools:
-            display_name = tool_map.get(tool_name)
+            display_name = TOOL_MAP.get(tool_name)
             item = QListWidgetItem(display_name); item.setData(Qt.UserRole, tool_name)
             self.tool_list.addItem(item)
+            placeholder = QLabel(f"正在加载 {display_name}..."); placeholder.setAlignment(Qt.AlignCenter)
+            self.stack.addWidget(placeholder)
+
+        if self.tool_list.count() > 0: self.tool_list.setCurrentRow(0)
 
-            try:
-                module_path = f"tools.{tool_name}.pyside_tool"
-                if not os.path.exists(module_path.replace('.', '/') + '.py'):
-                    raise FileNotFoundError(f"{module_path}.py not found")
-                module = importlib.import_module(module_path)
-                widget_class = next(c for c in vars(module).values() if isinstance(c, type) and issubclass(c, QWidget) and c is not QWidget)
-                widget = widget_class(self)
-                widget.setObjectName("ToolPanel")
-            except Exception as e:
-                widget = QLabel(f"加载工具 {tool_name} 失败:\n{e}"); widget.setAlignment(Qt.AlignCenter)
+    def build_tool(self, row):
+        if row in self.tool_widgets: return
+        tool_name = self.tool_list.item(row).data(Qt.UserRole)
+        started = time.perf_counter()
+        try:
+            module_path = f"tools.{tool_name}.pyside_tool"
+            if not os.path.exists(module_path.replace('.', '/') + '.py'):
+                raise FileNotFoundError(f"{module_path}.py not found")
+            module = importlib.import_module(module_path)
+            imported = time.perf_counter()
+            # Only classes defined in the tool module itself, not imported Qt widgets such as QPushButton
+            widget_class = next(c for c in vars(module).values() if isinstance(c, type) and issubclass(c, QWidget) and c.__module__ == module.__name__)
+            widget = widget_class(self)
+            widget.setObjectName("ToolPanel")
+            log_timing(f"{tool_name} import", imported - started)
+            log_timing(f"{tool_name} build", time.perf_counter() - imported)
+        except Exception as e:
+            widget = QLabel(f"加载工具 {tool_name} 失败:\n{e}"); widget.setAlignment(Qt.AlignCenter)
 
-            self.stack.addWidget(widget)
+        placeholder = self.stack.widget(row)
+        self.stack.removeWidget(placeholder); placeholder.deleteLater()
+        self.stack.insertWidget(row, widget)
+        self.tool_widgets[row] = widget
 
-        if self.tool_list.count() > 0: self.tool_list.setCurrentRow(0)
+    def switch_tool(self, item):
+        row = self.tool_list.row(item)
+        self.build_tool(row)
+        self.stack.setCurrentIndex(row)
+
+    def on_shown(self):
+        """Runs on the first event loop iteration after show(): builds the initial tool, then preloads the rest."""
+        log_timing("window shown", time.perf_counter() - STARTUP_T0)
+        if self.tool_list.count() > 0:
+            self.switch_tool(self.tool_list.currentItem())
+            log_timing("first tool ready", time.perf_counter() - STARTUP_T0)
+        if PRELOAD_TOOLS:
+            pending = [f"tools.{self.tool_list.item(r).data(Qt.UserRole)}.pyside_tool" for r in range(self.tool_list.count()) if r not in self.tool_widgets]
+            self.preloader = ToolPreloader(pending)
+            self.preloader.finished.connect(self.on_tools_preloaded)
+            self.job_manager.submit("预加载工具模块", self.preloader, "io", PRIORITY_LOW)
+
+    def on_tools_preloaded(self, timings):
+        for module_path, seconds in timings.items(): log_timing(f"{module_path} background import", seconds)
 
-    def switch_tool(self, item): self.stack.setCurrentIndex(self.tool_list.row(item))
     def get_selected_model(self): return self.model_selector.currentText()
 
+    def get_keep_alive(self):
+        value = self.keep_alive_text
+        return int(value) if value.lstrip('-').isdigit() else value
+
+    def apply_keep_alive(self):
+        text = self.keep_alive_selector.currentText().strip()
+        if not KEEP_ALIVE_PATTERN.match(text):
+            self.model_status_label.setText(f"❌ 无效的保持时长: {text or '(空)'}")
+            self.keep_alive_selector.setCurrentText(self.keep_alive_text)
+            return
+        if text == self.keep_alive_text: return
+        self.keep_alive_text = text
+        # Set on the GUI thread so requests queued before the warm-up already use the new value
+        from tools.llm_client import get_client
+        get_client().keep_alive = self.get_keep_alive()
+        self.warm_up_model(self.get_selected_model())
+
+    def warm_up_model(self, model):
+        # Warm-ups run one at a time in their own slot; queued ones for any model are superseded by this one
+        for pending in self.warmup_jobs.values():
+            if pending.state == STATE_QUEUED: pending.cancel()
+        self.model_status_label.setText(f"⏳ 正在预热 {model}...")
+        worker = WarmupWorker(model, self.get_keep_alive())
+        worker.finished.connect(self.on_model_ready); worker.error.connect(self.on_model_error)
+        worker.cancelled.connect(lambda: self.on_model_error(model, "已取消"))
+        self.warmup_jobs[model] = self.job_manager.submit(f"模型预热: {model}", worker, "io", lane=LANE_WARMUP)
+
+    def on_model_ready(self, model, seconds):
+        # A slower warm-up for a previously selected model must not overwrite the current status
+        if model == self.get_selected_model(): self.model_status_label.setText(f"✅ {model} 已就绪 (加载 {seconds:.1f}s)")
+
+    def on_model_error(self, model, msg):
+        if model == self.get_selected_model(): self.model_status_label.setText(f"❌ {model} 预热失败: {msg}")
+
+    def update_model_metrics(self):
+        # Never import the client on the GUI thread just for the tooltip; it is loaded by the first warm-up
+        llm_client = sys.modules.get("tools.llm_client")
+        if llm_client is None: return
+        client = llm_client.get_client()
+        lines = [f"{model}: {m['count']} 次, 平均 {m['avg']:.2f}s, p95 {m['p95']:.2f}s" for model, m in sorted(client.metrics().items())] or ["暂无请求记录"]
+        # One line per Ollama endpoint from the pool's health and load
+        lines += [f"{'🟢' if e['healthy'] else '🔴'} {e['url']}: 进行中 {e['outstanding']}, 连续失败 {e['failures']}" for e in client.pool.status()]
+        self.model_status_label.setToolTip("\n".join(lines))
+
+    def closeEvent(self, event):
+        for widget in self.tool_widgets.values(): widget.close()
+        self.job_manager.shutdown()
+        metrics.flush()
+        super().closeEvent(event)
+
 if __name__ == "__main__":
     # High DPI scaling is on by default in recent Qt versions,
     # the explicit flags are deprecated and can be removed.
     sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
     app = QApplication(sys.argv)
     app.setStyleSheet(STYLESHEET)
-    window = MainWindow(); window.show(); sys.exit(app.exec())
+    log_timing("imports + QApplication", time.perf_counter() - STARTUP_T0)
+    window = MainWindow()
+    log_timing("main window constructed", time.perf_counter() - STARTUP_T0)
+    window.show()
+    QTimer.singleShot(0, window.on_shown)
+    sys.exit(app.exec())
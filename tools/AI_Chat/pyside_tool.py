@@ -1,30 +1,266 @@
-import sys, os, json, requests
-from PySide6.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout, QTextEdit, QLineEdit, QPushButton, QLabel
-from PySide6.QtCore import QObject, QThread, Signal, Qt
+import sys, os, json, time, requests
+from array import array
+from PySide6.QtWidgets import (
+    QWidget, QVBoxLayout, QHBoxLayout, QListView, QLineEdit, QPushButton, QLabel, QSpinBox, QAbstractItemView, QApplication
+)
+from PySide6.QtGui import QColor, QKeySequence, QAction
+from PySide6.QtCore import Signal, Qt, QAbstractListModel, QModelIndex
+from tools.llm_client import get_client
+from tools.job_manager import JobWorker, get_job_manager, PRIORITY_HIGH, PRIORITY_LOW, LANE_INTERACTIVE
+from tools.perf import observe
 
-class ChatWorker(QObject):
-    response_ready = Signal(str)
+STREAM_REFRESH_INTERVAL = 0.05  # seconds; streamed tokens are coalesced into one UI update per interval
+CONTEXT_TOKEN_BUDGET = 4096
+SUMMARIZE_AT = 0.75  # fold older turns into the summary once the recent window uses this share of the budget
+HISTORY_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "history")
+HISTORY_PAGE_SIZE = 200  # messages loaded when a session is opened and per scroll to the top
+ROLE_LABELS = {"user": "You", "assistant": "AI", "error": "错误", "status": ""}
+ROLE_COLORS = {"user": "#d4d4d8", "assistant": "#f43f5e", "error": "#ef4444", "status": "#a1a1aa"}
+SUMMARY_PROMPT = (
+    "Summarize the conversation below in a compact form for your own later reference. "
+    "Keep facts, decisions, names, numbers and open questions; answer in the conversation's language.\n\n"
+)
+
+def estimate_tokens(text):
+    # Roughly one token per CJK character and per four other characters, plus per-message overhead
+    cjk = sum(1 for ch in text if '\u3000' <= ch <= '\u9fff' or '\uac00' <= ch <= '\ud7af')
+    return cjk + (len(text) - cjk) // 4 + 4
+
+class ChatContext:
+    """Full transcript plus the prompt actually sent: a rolling summary of older turns and the recent
+    turns verbatim, kept within a token budget so per-turn prompt size stays flat in long sessions."""
+    def __init__(self, budget=CONTEXT_TOKEN_BUDGET):
+        self.budget = budget
+        self.messages = []
+        self.summary = ""
+        self.summarized_upto = 0  # messages[:summarized_upto] are covered by the summary
+
+    def append(self, role, content): self.messages.append({"role": role, "content": content})
+
+    def _summary_message(self):
+        if not self.summary: return []
+        return [{"role": "system", "content": f"Summary of the earlier conversation:\n{self.summary}"}]
+
+    def build(self):
+        # The summary only changes when a new summary lands, so the prompt prefix stays stable between turns
+        prefix = self._summary_message()
+        remaining = self.budget - sum(estimate_tokens(m["content"]) for m in prefix)
+        kept = []
+        for message in reversed(self.messages[self.summarized_upto:]):
+            cost = estimate_tokens(message["content"])
+            if kept and cost > remaining: break
+            kept.append(message); remaining -= cost
+        return prefix + kept[::-1]
+
+    def recent_tokens(self): return sum(estimate_tokens(m["content"]) for m in self.messages[self.summarized_upto:])
+
+    def messages_to_summarize(self):
+        """Returns (messages, upto) to fold into the summary, or None while the recent window fits."""
+        if self.recent_tokens() <= self.budget * SUMMARIZE_AT: return None
+        upto, recent = self.summarized_upto, self.recent_tokens()
+        # Fold whole turns from the oldest side until the recent window is back to half the budget
+        while upto < len(self.messages) - 2 and recent > self.budget / 2:
+            recent -= estimate_tokens(self.messages[upto]["content"])
+            upto += 1
+            if self.messages[upto - 1]["role"] == "user" and upto < len(self.messages):
+                recent -= estimate_tokens(self.messages[upto]["content"])
+                upto += 1
+        if upto <= self.summarized_upto: return None
+        return self.messages[self.summarized_upto:upto], upto
+
+    def apply_summary(self, summary, upto):
+        self.summary, self.summarized_upto = summary, max(self.summarized_upto, upto)
+
+class ChatLog:
+    """Append-only JSON-lines log of one conversation. A sidecar file of 8-byte line offsets lets any page,
+    typically the tail, be read without scanning the whole log."""
+    def __init__(self, path):
+        self.path = path
+        self.index_path = path + ".idx"
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.offsets = array('Q')
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'rb') as f:
+                data = f.read()
+            self.offsets.frombytes(data[:len(data) - len(data) % self.offsets.itemsize])
+        if not self._index_matches_log(): self._rebuild_index()
+
+    def _index_matches_log(self):
+        log_size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        if not self.offsets: return log_size == 0
+        if self.offsets[-1] >= log_size: return False
+        # The last indexed line must end exactly at the end of the log
+        with open(self.path, 'rb') as f:
+            f.seek(self.offsets[-1])
+            f.readline()
+            return f.tell() == log_size
+
+    def _rebuild_index(self):
+        self.offsets = array('Q')
+        if os.path.exists(self.path):
+            offset = 0
+            with open(self.path, 'r+b') as f:
+                for line in f:
+                    if not line.endswith(b"\n"): break
+                    self.offsets.append(offset)
+                    offset += len(line)
+                # Drop a torn last line left by a crash mid-write
+                f.truncate(offset)
+        with open(self.index_path, 'wb') as f:
+            f.write(self.offsets.tobytes())
+
+    def __len__(self): return len(self.offsets)
+
+    def append(self, message):
+        line = (json.dumps(message, ensure_ascii=False) + "\n").encode('utf-8')
+        with open(self.path, 'ab') as f:
+            offset = f.seek(0, os.SEEK_END)
+            f.write(line)
+        self.offsets.append(offset)
+        with open(self.index_path, 'ab') as f:
+            f.write(array('Q', [offset]).tobytes())
+
+    def read(self, start, stop):
+        start, stop = max(0, start), min(stop, len(self.offsets))
+        if start >= stop: return []
+        with open(self.path, 'rb') as f:
+            f.seek(self.offsets[start])
+            data = f.read(self.offsets[stop] - self.offsets[start]) if stop < len(self.offsets) else f.read()
+        return [json.loads(line) for line in data.splitlines() if line.strip()]
+
+    @staticmethod
+    def latest_session_path():
+        sessions = sorted(f for f in os.listdir(HISTORY_DIR) if f.endswith('.jsonl')) if os.path.isdir(HISTORY_DIR) else []
+        return os.path.join(HISTORY_DIR, sessions[-1]) if sessions else ChatLog.new_session_path()
+
+    @staticmethod
+    def new_session_path():
+        return os.path.join(HISTORY_DIR, time.strftime("%Y%m%d_%H%M%S") + ".jsonl")
+
+class ChatMessageModel(QAbstractListModel):
+    """Messages currently loaded from the log; the list view only lays out and paints what is visible."""
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.messages = []
+
+    def rowCount(self, parent=QModelIndex()): return 0 if parent.isValid() else len(self.messages)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid(): return None
+        message = self.messages[index.row()]
+        if role == Qt.DisplayRole:
+            label = ROLE_LABELS.get(message["role"], message["role"])
+            text = f"{label}: {message['content']}" if label else message["content"]
+            if message.get("stats"): text += f"\n{format_stats(message['stats'])}"
+            return text
+        if role == Qt.ForegroundRole: return QColor(ROLE_COLORS.get(message["role"], "#d4d4d8"))
+        return None
+
+    def append(self, message):
+        self.beginInsertRows(QModelIndex(), len(self.messages), len(self.messages))
+        self.messages.append(message)
+        self.endInsertRows()
+
+    def prepend(self, messages):
+        if not messages: return
+        self.beginInsertRows(QModelIndex(), 0, len(messages) - 1)
+        self.messages[:0] = messages
+        self.endInsertRows()
+
+    def update_last(self, **changes):
+        self.messages[-1].update(changes)
+        index = self.index(len(self.messages) - 1)
+        self.dataChanged.emit(index, index)
+
+    def remove_last(self):
+        self.beginRemoveRows(QModelIndex(), len(self.messages) - 1, len(self.messages) - 1)
+        self.messages.pop()
+        self.endRemoveRows()
+
+    def clear(self):
+        self.beginResetModel()
+        self.messages = []
+        self.endResetModel()
+
+def format_stats(stats):
+    ttft = f"{stats['ttft']:.2f}s" if stats.get("ttft") is not None else "-"
+    summary = f"首字延迟 {ttft} · {stats.get('tokens_per_sec', 0):.1f} tokens/s · {stats.get('tokens', 0)} tokens"
+    if stats.get("cancelled"): summary += " · 已停止"
+    return summary
+
+class SummaryWorker(JobWorker):
+    finished = Signal(str, int)
+    error = Signal(str)
+
+    def __init__(self, model, previous_summary, messages, upto):
+        super().__init__()
+        self.model = model
+        self.previous_summary = previous_summary
+        self.messages = messages
+        self.upto = upto
+        self.client = get_client()
+
+    def run(self):
+        try:
+            transcript = "\n".join(f"{m['role']}: {m['content']}" for m in self.messages)
+            if self.previous_summary:
+                transcript = f"Earlier summary:\n{self.previous_summary}\n\nNew messages:\n{transcript}"
+            messages = [{"role": "user", "content": SUMMARY_PROMPT + transcript}]
+            response_data = self.client.chat(self.model, messages, timeout=300, tool="AI_Chat")
+            self.finished.emit(response_data.get("message", {}).get("content", "").strip(), self.upto)
+        except Exception as e:
+            self.error.emit(f"生成对话摘要失败: {e}")
+
+class ChatWorker(JobWorker):
+    token_ready = Signal(str)
+    response_ready = Signal(str, dict)
     error = Signal(str)
 
     def __init__(self, model, messages):
         super().__init__()
         self.model = model
         self.messages = messages
-        self.api_url = "http://localhost:11434/api/chat"
+        self.client = get_client()
 
     def run(self):
         try:
-            payload = {
-                "model": self.model,
-                "messages": self.messages,
-                "stream": False # Keep it simple, no streaming for now
-            }
-            response = requests.post(self.api_url, json=payload, timeout=120)
-            response.raise_for_status()
+            started = time.perf_counter()
+            first_token_at = None
+            parts, pending, chunks, final = [], [], 0, {}
+            last_flush = started
+            # keep_alive (set by the client) keeps the model and its prompt cache loaded between turns
+            with self.client.stream_chat(self.model, self.messages, timeout=120, tool="AI_Chat") as response:
+                response.raise_for_status()
+                # Ollama streams one JSON object per line; the last one has "done": true and the eval stats
+                for line in response.iter_lines():
+                    if self.is_cancelled(): break
+                    if not line: continue
+                    data = json.loads(line)
+                    if data.get("error"): raise RuntimeError(data["error"])
+                    content = data.get("message", {}).get("content", "")
+                    if content:
+                        if first_token_at is None: first_token_at = time.perf_counter()
+                        parts.append(content); pending.append(content); chunks += 1
+                        self.report(chunks)
+                    now = time.perf_counter()
+                    if pending and now - last_flush >= STREAM_REFRESH_INTERVAL:
+                        self.token_ready.emit("".join(pending)); pending = []; last_flush = now
+                    if data.get("done"):
+                        final = data; break
+            if pending: self.token_ready.emit("".join(pending))
 
-            response_data = response.json()
-            ai_message = response_data.get("message", {}).get("content", "")
-            self.response_ready.emit(ai_message)
+            ended = time.perf_counter()
+            tokens = final.get("eval_count", chunks)
+            if final.get("eval_duration"):
+                tokens_per_sec = tokens / (final["eval_duration"] / 1e9)
+            else:
+                tokens_per_sec = tokens / (ended - first_token_at) if first_token_at and ended > first_token_at else 0.0
+            stats = {
+                "ttft": (first_token_at - started) if first_token_at else None,
+                "tokens": tokens, "tokens_per_sec": tokens_per_sec, "cancelled": self.is_cancelled()
+            }
+            if stats["ttft"] is not None: observe("llm.ttft", stats["ttft"])
+            self.response_ready.emit("".join(parts), stats)
 
         except requests.exceptions.RequestException as e:
             self.error.emit(f"API请求失败: {e}")
@@ -35,8 +271,12 @@ class AIChatWidget(QWidget):
     def __init__(self, main_window=None):
         super().__init__()
         self.main_window = main_window
-        self.threads = []
-        self.messages = []
+        self.context = ChatContext()
+        self.worker = None
+        self.summary_worker = None
+        self._reply_started = False
+        self.log = None
+        self.loaded_from = 0  # index in the log of the first message shown
 
         # --- UI Setup ---
         layout = QVBoxLayout()
@@ -45,85 +285,225 @@ class AIChatWidget(QWidget):
         title.setObjectName("title")
         layout.addWidget(title)
 
-        self.chat_history = QTextEdit()
-        self.chat_history.setReadOnly(True)
-        self.chat_history.setPlaceholderText("在这里开始对话...")
+        session_layout = QHBoxLayout()
+        self.session_label = QLabel()
+        self.new_session_button = QPushButton("🆕 新对话")
+        session_layout.addWidget(self.session_label, 1)
+        session_layout.addWidget(self.new_session_button)
+        layout.addLayout(session_layout)
+
+        self.history_model = ChatMessageModel(self)
+        self.chat_history = QListView()
+        self.chat_history.setModel(self.history_model)
+        self.chat_history.setWordWrap(True)
+        self.chat_history.setTextElideMode(Qt.ElideNone)
+        self.chat_history.setSpacing(4)
+        self.chat_history.setLayoutMode(QListView.Batched)
+        self.chat_history.setBatchSize(50)
+        self.chat_history.setVerticalScrollMode(QAbstractItemView.ScrollPerPixel)
+        self.chat_history.setSelectionMode(QAbstractItemView.ExtendedSelection)
+        copy_action = QAction(self.chat_history)
+        copy_action.setShortcut(QKeySequence.Copy)
+        copy_action.triggered.connect(self.copy_selected_messages)
+        self.chat_history.addAction(copy_action)
+        self.chat_history.verticalScrollBar().valueChanged.connect(self.on_history_scrolled)
         layout.addWidget(self.chat_history)
 
+        context_layout = QHBoxLayout()
+        context_layout.addWidget(QLabel("上下文预算 (tokens):"))
+        self.budget_input = QSpinBox()
+        self.budget_input.setRange(512, 131072)
+        self.budget_input.setSingleStep(512)
+        self.budget_input.setValue(CONTEXT_TOKEN_BUDGET)
+        self.budget_input.valueChanged.connect(self.set_context_budget)
+        context_layout.addWidget(self.budget_input)
+        context_layout.addStretch()
+        self.context_label = QLabel()
+        context_layout.addWidget(self.context_label)
+        layout.addLayout(context_layout)
+
         input_layout = QHBoxLayout()
         self.user_input = QLineEdit()
         self.user_input.setPlaceholderText("输入消息...")
         self.send_button = QPushButton("发送")
+        self.stop_button = QPushButton("⏹ 停止")
+        self.stop_button.setEnabled(False)
 
         input_layout.addWidget(self.user_input)
         input_layout.addWidget(self.send_button)
+        input_layout.addWidget(self.stop_button)
         layout.addLayout(input_layout)
         self.setLayout(layout)
 
         # --- Connections ---
         self.send_button.clicked.connect(self.send_message)
         self.user_input.returnPressed.connect(self.send_message)
+        self.stop_button.clicked.connect(self.stop_generation)
+        self.new_session_button.clicked.connect(self.start_new_session)
+
+        self.open_session(ChatLog.latest_session_path())
+
+    def open_session(self, path):
+        # A summary still running belongs to the previous conversation; its result is dropped by the handlers
+        if self.summary_worker: self.summary_worker.cancel()
+        self.summary_worker = None
+        self.log = ChatLog(path)
+        self.context = ChatContext(self.budget_input.value())
+        self.history_model.clear()
+        # Only the last page is read; older pages are loaded when scrolling to the top
+        self.loaded_from = max(0, len(self.log) - HISTORY_PAGE_SIZE)
+        for message in self.log.read(self.loaded_from, len(self.log)):
+            self.history_model.append(message)
+            self.context.append(message["role"], message["content"])
+        self.chat_history.scrollToBottom()
+        self.session_label.setText(f"会话: {os.path.basename(path)} ({len(self.log)} 条消息)")
+        self.update_context_label()
+
+    def start_new_session(self):
+        if self.worker: return
+        self.open_session(ChatLog.new_session_path())
+
+    def on_history_scrolled(self, value):
+        if value != self.chat_history.verticalScrollBar().minimum() or self.loaded_from == 0: return
+        start = max(0, self.loaded_from - HISTORY_PAGE_SIZE)
+        older = self.log.read(start, self.loaded_from)
+        self.loaded_from = start
+        self.history_model.prepend(older)
+        # Keep the message that was at the top in place
+        self.chat_history.scrollTo(self.history_model.index(len(older)), QAbstractItemView.PositionAtTop)
+
+    def copy_selected_messages(self):
+        rows = sorted(index.row() for index in self.chat_history.selectedIndexes())
+        QApplication.clipboard().setText("\n\n".join(self.history_model.data(self.history_model.index(r)) for r in rows))
+
+    def _append_message(self, message):
+        at_bottom = self.chat_history.verticalScrollBar().value() == self.chat_history.verticalScrollBar().maximum()
+        self.history_model.append(message)
+        if at_bottom: self.chat_history.scrollToBottom()
 
     def send_message(self):
         user_text = self.user_input.text().strip()
         if not user_text:
             return
 
-        # Append user message to history and UI
-        self.messages.append({"role": "user", "content": user_text})
-        self.chat_history.append(f"<b>You:</b> {user_text}")
+        # Append user message to history, log and UI
+        message = {"role": "user", "content": user_text, "ts": time.time()}
+        self.context.append("user", user_text)
+        self.log.append(message)
+        self._append_message(message)
         self.user_input.clear()
 
         # Disable input while waiting for response
         self.user_input.setEnabled(False)
         self.send_button.setEnabled(False)
-        self.chat_history.append("<i>AI 正在思考...</i>")
+        self.stop_button.setEnabled(True)
+        self.new_session_button.setEnabled(False)
+        self._append_message({"role": "status", "content": "AI 正在思考..."})
+        self._reply_started = False
 
-        # Get selected model from main window
+        # Run the API call as a background job
+        self.start_chat_worker(self.get_selected_model())
+
+    def get_selected_model(self):
         selected_model = "llama3.1:latest" # Default model
         if self.main_window and hasattr(self.main_window, 'get_selected_model'):
             selected_model = self.main_window.get_selected_model()
-
-        # Start worker thread for API call
-        self.start_chat_worker(selected_model)
+        return selected_model
 
     def start_chat_worker(self, model):
-        thread = QThread()
-        worker = ChatWorker(model, self.messages)
-        worker.moveToThread(thread)
-
+        worker = ChatWorker(model, self.context.build())
+        worker.token_ready.connect(self.handle_token)
         worker.response_ready.connect(self.handle_response)
         worker.error.connect(self.handle_error)
+        worker.cancelled.connect(self.handle_cancelled)
+        # Replies run in the interactive lane, so they start right away even when every batch slot is busy
+        get_job_manager().submit(f"AI聊天: {model}", worker, "io", PRIORITY_HIGH, lane=LANE_INTERACTIVE)
+        self.worker = worker
 
-        # Cleanup
-        worker.finished.connect(thread.quit)
-        worker.finished.connect(worker.deleteLater)
-        thread.finished.connect(thread.deleteLater)
+    def set_context_budget(self, value):
+        self.context.budget = value
+        self.update_context_label()
 
-        thread.started.connect(worker.run)
-        thread.start()
-        self.threads.append(thread)
+    def update_context_label(self):
+        sent = sum(estimate_tokens(m["content"]) for m in self.context.build())
+        folded = f" · 已摘要 {self.context.summarized_upto} 条消息" if self.context.summarized_upto else ""
+        self.context_label.setText(f"本轮上下文约 {sent}/{self.context.budget} tokens{folded}")
 
-    def handle_response(self, ai_text):
-        # Remove "thinking" message
-        self.chat_history.undo()
+    def maybe_summarize(self):
+        if self.summary_worker is not None: return
+        pending = self.context.messages_to_summarize()
+        if pending is None: return
+        messages, upto = pending
 
-        self.messages.append({"role": "assistant", "content": ai_text})
-        self.chat_history.append(f"<b style='color:#f43f5e;'>AI:</b> {ai_text}\n")
+        worker = SummaryWorker(self.get_selected_model(), self.context.summary, messages, upto)
+        worker.finished.connect(self.handle_summary)
+        worker.error.connect(self.handle_summary_error)
+        worker.cancelled.connect(self.handle_summary_cancelled)
+        get_job_manager().submit("AI聊天: 对话摘要", worker, "io", PRIORITY_LOW)
+        self.summary_worker = worker
 
-        self.user_input.setEnabled(True)
-        self.send_button.setEnabled(True)
-        self.user_input.setFocus()
+    def handle_summary(self, summary, upto):
+        if self.sender() is not self.summary_worker: return
+        self.summary_worker = None
+        if summary: self.context.apply_summary(summary, upto)
+        self.update_context_label()
+
+    def handle_summary_cancelled(self):
+        if self.sender() is not self.summary_worker: return
+        self.summary_worker = None
+
+    def handle_summary_error(self, error_message):
+        # Turns that could not be summarized stay verbatim and are trimmed by the budget instead
+        if self.sender() is not self.summary_worker: return
+        self.summary_worker = None
+        self.context_label.setText(error_message)
+
+    def stop_generation(self):
+        if self.worker: self.worker.cancel()
+        self.stop_button.setEnabled(False)
+
+    def _start_reply(self):
+        # The "thinking" row becomes the reply row once the first tokens arrive
+        if self._reply_started: return
+        self.history_model.update_last(role="assistant", content="")
+        self._reply_started = True
+
+    def handle_token(self, text):
+        self._start_reply()
+        at_bottom = self.chat_history.verticalScrollBar().value() == self.chat_history.verticalScrollBar().maximum()
+        self.history_model.update_last(content=self.history_model.messages[-1]["content"] + text)
+        if at_bottom: self.chat_history.scrollToBottom()
+
+    def handle_response(self, ai_text, stats):
+        self._start_reply()
+        message = {"role": "assistant", "content": ai_text, "ts": time.time(), "stats": stats}
+        self.context.append("assistant", ai_text)
+        self.log.append(message)
+        self.history_model.update_last(**message)
+        self._finish_turn()
+        self.update_context_label()
+        self.maybe_summarize()
 
     def handle_error(self, error_message):
-        self.chat_history.undo()
-        self.chat_history.append(f"<b style='color:red;'>错误:</b> {error_message}\n")
+        if not self._reply_started: self.history_model.remove_last()
+        self._append_message({"role": "error", "content": error_message})
+        self._finish_turn()
+
+    def handle_cancelled(self):
+        # Only sent when the job was cancelled while still queued; a running reply ends via handle_response
+        if not self._reply_started: self.history_model.remove_last()
+        self._append_message({"role": "status", "content": "已停止"})
+        self._finish_turn()
+
+    def _finish_turn(self):
+        self.worker = None
         self.user_input.setEnabled(True)
         self.send_button.setEnabled(True)
+        self.stop_button.setEnabled(False)
+        self.new_session_button.setEnabled(True)
+        self.session_label.setText(f"会话: {os.path.basename(self.log.path)} ({len(self.log)} 条消息)")
         self.user_input.setFocus()
 
     def closeEvent(self, event):
-        for thread in self.threads:
-            thread.quit()
-            thread.wait()
+        if self.worker: self.worker.cancel()
         super().closeEvent(event)
@@ -1,43 +1,138 @@
-import os, pandas as pd
+import os, threading
+from collections import OrderedDict
 from PySide6.QtWidgets import (
     QWidget, QHBoxLayout, QVBoxLayout, QPushButton, QLabel,
     QDateEdit, QGridLayout, QLineEdit, QMessageBox
 )
-from PySide6.QtCore import QDate, QObject, QThread, Signal, Qt
+from PySide6.QtCore import QDate, Signal, Qt
 from PySide6.QtGui import QIntValidator
-
-class Worker(QObject):
+from tools.job_manager import JobWorker, get_job_manager, PRIORITY_NORMAL
+from tools.perf import span, inc
+
+DATA_PATH = os.path.join(os.path.dirname(__file__), 'data')
+DATA_FILES = {'users': 'wp_users_affilate_tmp.csv', 'orders': 'wp_erp_order_tmp.csv', 'packages': 'wp_erp_packeage_tmp.csv'}
+DAILY_METRICS = {"注册用户数": 'reg_time', "激活用户数": 'verified_time', "活跃人数": 'activate_time'}
+CACHE_MAX_ENTRIES = 256  # affiliates kept in the report cache
+CACHE_MAX_BYTES = 32 * 1024 * 1024
+
+def data_version(data_path=DATA_PATH):
+    """Changes whenever one of the CSVs is rewritten; part of every cache key."""
+    return tuple((name, st.st_mtime_ns, st.st_size) for name, st in ((n, os.stat(os.path.join(data_path, f))) for n, f in DATA_FILES.items()))
+
+class ReportCache:
+    """LRU of per-affiliate report data keyed by (affiliate_id, data version), bounded by entry count and bytes.
+    Per-day counts are kept instead of range results, so any later date range is summed from them."""
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, max_bytes=CACHE_MAX_BYTES):
+        self.max_entries, self.max_bytes = max_entries, max_bytes
+        self.entries = OrderedDict()  # key -> (entry, size)
+        self.bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self.entries: return None
+            self.entries.move_to_end(key)
+            return self.entries[key][0]
+
+    def put(self, key, entry, size):
+        with self._lock:
+            if key in self.entries: self.bytes -= self.entries.pop(key)[1]
+            self.entries[key] = (entry, size)
+            self.bytes += size
+            while len(self.entries) > 1 and (len(self.entries) > self.max_entries or self.bytes > self.max_bytes):
+                self.bytes -= self.entries.popitem(last=False)[1][1]
+
+    def invalidate(self, version):
+        """Drops every entry computed from another version of the data files."""
+        with self._lock:
+            for key in [k for k in self.entries if k[1] != version]: self.bytes -= self.entries.pop(key)[1]
+
+report_cache = ReportCache()
+_frames = {}  # version -> (users_df, orders_df, packages_df); only the current version is kept
+_frames_lock = threading.Lock()
+
+def load_frames(version, data_path=DATA_PATH):
+    import pandas as pd
+    # Held while reading so concurrent reports share one load instead of parsing the CSVs twice
+    with _frames_lock:
+        if version not in _frames:
+            with span("affiliate.load_csv"):
+                frames = tuple(pd.read_csv(os.path.join(data_path, f), encoding='gb18030') for f in DATA_FILES.values())
+                for df in frames:
+                    for col in df.columns:
+                        if 'time' in col: df[col] = pd.to_datetime(df[col], errors='coerce')
+            _frames.clear(); _frames[version] = frames
+            report_cache.invalidate(version)
+        return _frames[version]
+
+def build_report_entry(affiliate_id, users_df, orders_df, packages_df):
+    df_users = users_df[users_df['affilate'] == affiliate_id]
+    df_orders = orders_df[orders_df['affilate'] == affiliate_id]
+    df_packages = packages_df[packages_df['affilate'] == affiliate_id]
+    if df_users.empty and df_orders.empty and df_packages.empty: return None, 0
+    # Counts per calendar day over the affiliate's whole history; order and package totals are not date-filtered
+    days = {name: df_users[col].dropna().dt.normalize().value_counts().sort_index() for name, col in DAILY_METRICS.items()}
+    totals = {
+        "下单人数": df_orders['uid'].nunique(), "下单数量": len(df_orders), "下单总金额": df_orders['total_cny'].sum(),
+        "提包人数": df_packages['uid'].nunique(), "提包数量": len(df_packages), "提包总金额": df_packages['total_cny'].sum()
+    }
+    size = sum(int(series.memory_usage(deep=True)) for series in days.values()) + 1024
+    return {"days": days, "totals": totals}, size
+
+def report_from_entry(entry, start_date, end_date):
+    import pandas as pd
+    first, last = pd.Timestamp(start_date).normalize(), pd.Timestamp(end_date).normalize()
+    metrics = {name: int(series.loc[first:last].sum()) for name, series in entry["days"].items()}
+    metrics.update(entry["totals"])
+    metrics["收单总金额"] = metrics["下单总金额"] + metrics["提包总金额"]
+    return metrics
+
+def is_whole_days(start_date, end_date):
+    # The widget always asks for 00:00:00 .. 23:59:59; other ranges cannot be summed from per-day counts
+    return (start_date.hour, start_date.minute, start_date.second, start_date.microsecond) == (0, 0, 0, 0) and (end_date.hour, end_date.minute, end_date.second) == (23, 59, 59)
+
+class Worker(JobWorker):
     finished = Signal(object); error = Signal(str)
     def __init__(self, affiliate_id, start_date, end_date):
         super().__init__(); self.affiliate_id = affiliate_id; self.start_date = start_date; self.end_date = end_date
-        self.DATA_PATH = os.path.join(os.path.dirname(__file__), 'data')
+        self.DATA_PATH = DATA_PATH
     def run(self):
         try:
-            users_df = pd.read_csv(os.path.join(self.DATA_PATH, 'wp_users_affilate_tmp.csv'), encoding='gb18030')
-            orders_df = pd.read_csv(os.path.join(self.DATA_PATH, 'wp_erp_order_tmp.csv'), encoding='gb18030')
-            packages_df = pd.read_csv(os.path.join(self.DATA_PATH, 'wp_erp_packeage_tmp.csv'), encoding='gb18030')
-            for df in [users_df, orders_df, packages_df]:
-                for col in df.columns:
-                    if 'time' in col: df[col] = pd.to_datetime(df[col], errors='coerce')
-
-            df_users = users_df[users_df['affilate'] == self.affiliate_id]
-            df_orders = orders_df[orders_df['affilate'] == self.affiliate_id]
-            df_packages = packages_df[packages_df['affilate'] == self.affiliate_id]
-
-            if df_users.empty and df_orders.empty and df_packages.empty:
+            version = data_version(self.DATA_PATH)
+            users_df, orders_df, packages_df = load_frames(version, self.DATA_PATH)
+            with span("affiliate.metrics", affiliate=self.affiliate_id):
+                if is_whole_days(self.start_date, self.end_date): metrics = self.cached_metrics(version, users_df, orders_df, packages_df)
+                else: metrics = self.compute_metrics(users_df, orders_df, packages_df)
+            if metrics is None:
                 self.error.emit(f"找不到网红ID {self.affiliate_id} 的任何记录。"); return
-
-            metrics = {
-                "注册用户数": len(df_users[(df_users['reg_time'] >= self.start_date) & (df_users['reg_time'] <= self.end_date)]),
-                "激活用户数": len(df_users[(df_users['verified_time'] >= self.start_date) & (df_users['verified_time'] <= self.end_date)]),
-                "活跃人数": len(df_users[(df_users['activate_time'] >= self.start_date) & (df_users['activate_time'] <= self.end_date)]),
-                "下单人数": df_orders['uid'].nunique(), "下单数量": len(df_orders), "下单总金额": df_orders['total_cny'].sum(),
-                "提包人数": df_packages['uid'].nunique(), "提包数量": len(df_packages), "提包总金额": df_packages['total_cny'].sum()
-            }
-            metrics["收单总金额"] = metrics["下单总金额"] + metrics["提包总金额"]
             self.finished.emit(metrics)
         except FileNotFoundError: self.error.emit("错误：一个或多个数据文件不存在。")
         except Exception as e: self.error.emit(f"处理数据时出错: {e}")
+    def cached_metrics(self, version, users_df, orders_df, packages_df):
+        key = (self.affiliate_id, version)
+        entry = report_cache.get(key)
+        inc("affiliate.cache_hit" if entry is not None else "affiliate.cache_miss")
+        if entry is None:
+            entry, size = build_report_entry(self.affiliate_id, users_df, orders_df, packages_df)
+            if entry is None: return None
+            report_cache.put(key, entry, size)
+        return report_from_entry(entry, self.start_date, self.end_date)
+    def compute_metrics(self, users_df, orders_df, packages_df):
+        df_users = users_df[users_df['affilate'] == self.affiliate_id]
+        df_orders = orders_df[orders_df['affilate'] == self.affiliate_id]
+        df_packages = packages_df[packages_df['affilate'] == self.affiliate_id]
+
+        if df_users.empty and df_orders.empty and df_packages.empty: return None
+
+        metrics = {
+            "注册用户数": len(df_users[(df_users['reg_time'] >= self.start_date) & (df_users['reg_time'] <= self.end_date)]),
+            "激活用户数": len(df_users[(df_users['verified_time'] >= self.start_date) & (df_users['verified_time'] <= self.end_date)]),
+            "活跃人数": len(df_users[(df_users['activate_time'] >= self.start_date) & (df_users['activate_time'] <= self.end_date)]),
+            "下单人数": df_orders['uid'].nunique(), "下单数量": len(df_orders), "下单总金额": df_orders['total_cny'].sum(),
+            "提包人数": df_packages['uid'].nunique(), "提包数量": len(df_packages), "提包总金额": df_packages['total_cny'].sum()
+        }
+        metrics["收单总金额"] = metrics["下单总金额"] + metrics["提包总金额"]
+        return metrics
 
 class AffiliateDataWidget(QWidget):
     def __init__(self, main_window=None):
@@ -86,12 +181,10 @@ class AffiliateDataWidget(QWidget):
         self.generate_button.setDisabled(True); self.generate_button.setText("正在生成...")
         self.clear_layout(self.report_layout); self.report_layout.addWidget(QLabel("正在计算..."))
 
-        self.thread = QThread()
         self.worker = Worker(int(self.id_input.text()), self.start_date_input.dateTime().toPython(), self.end_date_input.dateTime().toPython().replace(hour=23, minute=59, second=59))
-        self.worker.moveToThread(self.thread)
         self.worker.finished.connect(self.on_report_finished); self.worker.error.connect(self.on_report_error)
-        self.worker.finished.connect(self.thread.quit); self.worker.finished.connect(self.worker.deleteLater)
-        self.thread.finished.connect(self.thread.deleteLater); self.thread.started.connect(self.worker.run); self.thread.start()
+        self.worker.cancelled.connect(self.on_report_cancelled)
+        get_job_manager().submit(f"联盟数据: {self.id_input.text()}", self.worker, "cpu", PRIORITY_NORMAL)
 
     def on_report_finished(self, metrics):
         self.clear_layout(self.report_layout)
@@ -112,6 +205,10 @@ class AffiliateDataWidget(QWidget):
         QMessageBox.critical(self, "错误", msg)
         self.generate_button.setDisabled(False); self.generate_button.setText("🚀 生成分析报告")
 
+    def on_report_cancelled(self):
+        self.clear_layout(self.report_layout); self.report_layout.addWidget(QLabel("已取消。"))
+        self.generate_button.setDisabled(False); self.generate_button.setText("🚀 生成分析报告")
+
     def clear_layout(self, layout):
         while layout.count():
             child = layout.takeAt(0)
@@ -1,67 +1,346 @@
-import os, sys, json, pandas as pd, io, requests
+import os, sys, json, io, requests, sqlite3, time, hashlib, pickle, bisect
 from zipfile import ZipFile
 from PySide6.QtWidgets import (
     QWidget, QVBoxLayout, QHBoxLayout, QPushButton, QLabel, QFileDialog,
-    QLineEdit, QComboBox, QTableView, QAbstractItemView, QMessageBox, QTabWidget, QTextEdit
+    QLineEdit, QComboBox, QTableView, QAbstractItemView, QMessageBox, QTabWidget, QTextEdit, QCheckBox, QHeaderView
 )
-from PySide6.QtGui import QStandardItemModel, QStandardItem
-from PySide6.QtCore import QObject, QThread, Signal, Qt
+from PySide6.QtCore import Signal, Qt, QAbstractTableModel, QModelIndex
+from tools.llm_client import get_client
+from tools.job_manager import JobWorker, get_job_manager, run_bounded, PRIORITY_LOW, PRIORITY_NORMAL
+
+MISSING = "【缺失】"
+BASE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "en")
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache")
+INDEX_CACHE_PATH = os.path.join(CACHE_DIR, "base_index.pickle")
+INDEX_VERSION = 1
+TM_DB_PATH = os.path.join(CACHE_DIR, "translation_memory.db")
+CHECKPOINT_DIR = os.path.join(CACHE_DIR, "checkpoints")
+CHECKPOINT_EVERY = 50  # keys between partial checkpoints inside one file
+ROW_FILTERS = {"全部": "all", "已修改": "changed", "缺失": "missing", "未变化": "identical"}
+
+class BaseCorpusIndex:
+    """All EN page files in one index: key -> files, value -> (file, key) and substring search over both."""
+    def __init__(self, files, signature):
+        self.version = INDEX_VERSION
+        self.files = files
+        self.signature = signature
+        self.key_to_files = {}
+        self.value_to_keys = {}
+        self.entries = []  # (filename, key), in blob order
+        for filename, content in files.items():
+            for key, value in content.items():
+                self.key_to_files.setdefault(key, []).append(filename)
+                self.value_to_keys.setdefault(str(value), []).append((filename, key))
+                self.entries.append((filename, key))
+        # One lower-cased blob of "key<TAB>value" lines; offsets map a match back to its entry
+        parts, self.offsets, pos = [], [], 0
+        for filename, key in self.entries:
+            text = f"{key}\t{files[filename][key]}".lower().replace("\n", " ")
+            self.offsets.append(pos)
+            parts.append(text)
+            pos += len(text) + 1
+        self.blob = "\n".join(parts)
+
+    def __len__(self): return len(self.entries)
+
+    def files_for_key(self, key): return self.key_to_files.get(key, [])
+
+    def keys_for_value(self, value): return self.value_to_keys.get(value, [])
+
+    def search(self, text, limit=1000):
+        needle = text.lower()
+        results, start = [], 0
+        while needle and len(results) < limit:
+            pos = self.blob.find(needle, start)
+            if pos < 0: break
+            i = bisect.bisect_right(self.offsets, pos) - 1
+            results.append(self.entries[i])
+            start = self.offsets[i + 1] if i + 1 < len(self.offsets) else len(self.blob)
+        return results
+
+    @staticmethod
+    def scan_signature(base_path=BASE_DIR):
+        signature = {}
+        for filename in sorted(os.listdir(base_path)):
+            if filename.endswith('.json'):
+                st = os.stat(os.path.join(base_path, filename))
+                signature[filename] = (st.st_mtime_ns, st.st_size)
+        return signature
+
+    @classmethod
+    def load(cls, base_path=BASE_DIR, cache_path=INDEX_CACHE_PATH):
+        """Returns (index, from_cache). The on-disk cache is reused while every file's mtime and size match."""
+        if not os.path.exists(base_path): raise FileNotFoundError(f"基准文件夹 '{base_path}' 不存在。")
+        signature = cls.scan_signature(base_path)
+        if not signature: raise ValueError("在基准文件夹中没有找到任何.json文件。")
 
-class TranslatorWorker(QObject):
+        try:
+            with open(cache_path, 'rb') as f: cached = pickle.load(f)
+            if getattr(cached, 'version', None) == INDEX_VERSION and cached.signature == signature:
+                return cached, True
+        except Exception:
+            pass  # The cache is optional: anything unreadable (e.g. a renamed module) is rebuilt from the JSON files
+
+        files = {}
+        for filename in signature:
+            with open(os.path.join(base_path, filename), 'r', encoding='utf-8') as f:
+                files[filename] = json.load(f)
+        index = cls(files, signature)
+        try:
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            with open(cache_path + ".tmp", 'wb') as f: pickle.dump(index, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(cache_path + ".tmp", cache_path)
+        except (OSError, pickle.PicklingError):
+            pass
+        return index, False
+
+class BaseIndexLoader(JobWorker):
+    finished = Signal(object, bool)
+    error = Signal(str)
+
+    def run(self):
+        try:
+            index, from_cache = BaseCorpusIndex.load()
+            self.finished.emit(index, from_cache)
+        except Exception as e:
+            self.error.emit(str(e))
+
+class ArrayTableModel(QAbstractTableModel):
+    """Read-only table over plain column lists. Views only ask for the cells they paint,
+    so large page files no longer need one QStandardItem per cell."""
+    def __init__(self, headers, columns, original_col, compare_col, parent=None):
+        super().__init__(parent)
+        self.headers = headers
+        self.columns = columns
+        self.original_col = original_col  # column checked for MISSING; None for tables the row filter does not apply to
+        self.compare_col = compare_col    # column compared with original_col for changed / identical
+        self.rows = range(len(columns[0]) if columns else 0)
+
+    def rowCount(self, parent=QModelIndex()): return 0 if parent.isValid() else len(self.rows)
+    def columnCount(self, parent=QModelIndex()): return 0 if parent.isValid() else len(self.columns)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or role not in (Qt.DisplayRole, Qt.ToolTipRole): return None
+        return self.columns[index.column()][self.rows[index.row()]]
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole: return None
+        if orientation == Qt.Horizontal: return self.headers[section]
+        return str(self.rows[section] + 1)
+
+    def set_filter(self, mode):
+        if self.original_col is None: return
+        original, compared = self.columns[self.original_col], self.columns[self.compare_col]
+        if mode == "missing":
+            rows = [i for i, value in enumerate(original) if value == MISSING]
+        elif mode == "changed":
+            rows = [i for i, (a, b) in enumerate(zip(original, compared)) if a != b]
+        elif mode == "identical":
+            rows = [i for i, (a, b) in enumerate(zip(original, compared)) if a == b]
+        else:
+            rows = range(len(original))
+        self.beginResetModel()
+        self.rows = rows
+        self.endResetModel()
+
+class TranslationMemory:
+    """Persistent translation memory keyed by (model, target language, source text, current translation)."""
+    def __init__(self, db_path=TM_DB_PATH):
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS memory ("
+            "model TEXT NOT NULL, target_lang TEXT NOT NULL, source TEXT NOT NULL, current TEXT NOT NULL, "
+            "result TEXT NOT NULL, updated_at REAL NOT NULL, "
+            "PRIMARY KEY (model, target_lang, source, current))"
+        )
+        self.conn.commit()
+
+    def get(self, model, target_lang, source, current):
+        row = self.conn.execute(
+            "SELECT result FROM memory WHERE model=? AND target_lang=? AND source=? AND current=?",
+            (model, target_lang, source, current)
+        ).fetchone()
+        return row[0] if row else None
+
+    def put(self, model, target_lang, source, current, result):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO memory (model, target_lang, source, current, result, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (model, target_lang, source, current, result, time.time())
+        )
+
+    def commit(self): self.conn.commit()
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+class RunCheckpoint:
+    """On-disk progress of one Translator run, so a failed or cancelled run resumes where it stopped."""
+    def __init__(self, run_id, checkpoint_dir=CHECKPOINT_DIR):
+        self.path = os.path.join(checkpoint_dir, f"{run_id}.json")
+        self.files = {}  # filename -> {key: result}, including partially finished files
+        self.completed = []
+
+    @staticmethod
+    def make_run_id(model, target_lang, base_files, target_files, use_cache=True):
+        # use_cache is part of the id: a run that bypasses the cache must not resume from cached answers
+        common = sorted(base_files.keys() & target_files.keys())
+        payload = json.dumps([model, target_lang, use_cache, [(f, base_files[f], target_files[f]) for f in common]], ensure_ascii=False, sort_keys=True)
+        return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+    def load(self):
+        if not os.path.exists(self.path): return False
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f: data = json.load(f)
+            self.files, self.completed = data.get("files", {}), data.get("completed", [])
+            return True
+        except (OSError, ValueError):
+            return False
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"files": self.files, "completed": self.completed}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def discard(self):
+        if os.path.exists(self.path): os.remove(self.path)
+
+class TranslatorWorker(JobWorker):
     finished = Signal(dict)
+    file_finished = Signal(str, dict)
     progress = Signal(str)
     error = Signal(str)
+    cache_stats = Signal(int, int)  # (hits, total)
 
-    def __init__(self, model, base_files, target_files, target_lang):
+    def __init__(self, model, base_files, target_files, target_lang, use_cache=True):
         super().__init__()
         self.model = model
         self.base_files = base_files
         self.target_files = target_files
         self.target_lang = target_lang
-        self.api_url = "http://localhost:11434/api/chat"
+        self.use_cache = use_cache
+        self.client = get_client()
+
+    def translate(self, filename, base_value, original_translation):
+        if original_translation is None or original_translation == MISSING:
+            prompt = f'TARGET LANGUAGE: {self.target_lang}\nPAGE CONTEXT: {filename}\nSOURCE (English): "{base_value}"'
+        else:
+            prompt = f'TARGET LANGUAGE: {self.target_lang}\nPAGE CONTEXT: {filename}\nSOURCE (English): "{base_value}"\nCURRENT ({self.target_lang}): "{original_translation}"'
+
+        response_data = self.client.chat(self.model, [{"role": "user", "content": prompt}], timeout=120, tool="Translator")
+        ai_result = response_data['message']['content']
+        return ai_result.strip().strip('"').strip("'")
 
     def run(self):
+        memory = None
+        executor = get_job_manager().executor("io")
+        checkpoint = RunCheckpoint(RunCheckpoint.make_run_id(self.model, self.target_lang, self.base_files, self.target_files, self.use_cache))
         try:
+            if checkpoint.load():
+                self.progress.emit(f"从断点恢复: 已完成 {len(checkpoint.completed)} 个文件。")
+            memory = TranslationMemory()
+            # Identical (source, current) pairs are only sent once per run, whichever page they come from
+            run_memo = {}
+            hits, total, answered = 0, 0, 0
+            run_keys = sum(len(content) for filename, content in self.base_files.items() if filename in self.target_files)
             all_optimized_data = {}
             for filename, base_content in self.base_files.items():
                 if filename not in self.target_files:
                     continue
+                if filename in checkpoint.completed:
+                    all_optimized_data[filename] = checkpoint.files[filename]
+                    self.file_finished.emit(filename, checkpoint.files[filename])
+                    continue
 
                 self.progress.emit(f"正在处理 {filename}...")
                 target_content = self.target_files[filename]
-                optimized_file_content = {}
+                optimized_file_content = checkpoint.files.setdefault(filename, {})
+                calls = []    # (filename, source, current) to send to the model; (source, current) is the pair
+                waiting = {}  # (source, current) -> keys of this file waiting for that answer
 
                 for key, base_value in base_content.items():
+                    if key in optimized_file_content:
+                        continue
                     original_translation = target_content.get(key)
-
-                    if original_translation is None or original_translation == "【缺失】":
-                        prompt = f'TARGET LANGUAGE: {self.target_lang}\nPAGE CONTEXT: {filename}\nSOURCE (English): "{base_value}"'
+                    pair = (str(base_value), MISSING if original_translation is None else str(original_translation))
+                    total += 1
+
+                    result = run_memo.get(pair)
+                    if result is None and self.use_cache:
+                        result = memory.get(self.model, self.target_lang, *pair)
+                    if result is not None:
+                        hits += 1
+                        run_memo[pair] = result
+                        optimized_file_content[key] = result
+                    elif pair in waiting:
+                        hits += 1
+                        waiting[pair].append(key)
                     else:
-                        prompt = f'TARGET LANGUAGE: {self.target_lang}\nPAGE CONTEXT: {filename}\nSOURCE (English): "{base_value}"\nCURRENT ({self.target_lang}): "{original_translation}"'
-
-                    response = requests.post(
-                        self.api_url,
-                        json={"model": self.model, "messages": [{"role": "user", "content": prompt}], "stream": False},
-                        timeout=120
-                    )
-                    response.raise_for_status()
-                    ai_result = response.json()['message']['content']
-
-                    cleaned_result = ai_result.strip().strip('"').strip("'")
-                    optimized_file_content[key] = cleaned_result
-
+                        waiting[pair] = [key]
+                        calls.append((filename, *pair))
+
+                done_since_checkpoint = 0
+                failure = None
+                # One in-flight request per endpoint slot, so a batch scales with the number of model servers.
+                # After a cancel or an error nothing new is submitted, but the requests in flight are still
+                # waited for and stored, so a resumed run never repeats an LLM call that already came back.
+                completed = run_bounded(executor, self.translate, calls, self.client.pool.capacity,
+                                        lambda: self.is_cancelled() or failure is not None)
+                for (_, *pair), future in completed:
+                    pair = tuple(pair)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        failure = failure or e
+                        continue
+                    memory.put(self.model, self.target_lang, *pair, result)
+                    run_memo[pair] = result
+                    for key in waiting[pair]: optimized_file_content[key] = result
+                    answered += 1
+                    self.report(hits + answered, run_keys)
+                    done_since_checkpoint += 1
+                    if done_since_checkpoint >= CHECKPOINT_EVERY:
+                        memory.commit(); checkpoint.save()
+                        done_since_checkpoint = 0
+                if failure is not None or self.is_cancelled():
+                    memory.commit(); checkpoint.save()
+                    if failure is not None: raise failure
+                    self.cancelled.emit(); return
+
+                # Keep the base file's key order in the saved JSON
+                optimized_file_content = {key: optimized_file_content[key] for key in base_content if key in optimized_file_content}
+                checkpoint.files[filename] = optimized_file_content
+
+                memory.commit()
+                checkpoint.completed.append(filename)
+                checkpoint.save()
+                self.cache_stats.emit(hits, total)
                 all_optimized_data[filename] = optimized_file_content
+                self.file_finished.emit(filename, optimized_file_content)
+            checkpoint.discard()
             self.finished.emit(all_optimized_data)
         except requests.exceptions.RequestException as e:
+            self._save_checkpoint_quietly(checkpoint)
             self.error.emit(f"调用AI失败: {e}")
         except Exception as e:
+            self._save_checkpoint_quietly(checkpoint)
             self.error.emit(f"处理时出错: {e}")
+        finally:
+            if memory: memory.close()
+
+    def _save_checkpoint_quietly(self, checkpoint):
+        try: checkpoint.save()
+        except OSError: pass
 
 class TranslatorWidget(QWidget):
     def __init__(self, main_window=None):
         super().__init__()
         self.main_window = main_window
         self.base_files_content = {}
+        self.base_index = None
         self.target_files_content = {}
         self.ai_results = {}
 
@@ -76,9 +355,13 @@ class TranslatorWidget(QWidget):
         main_layout.addWidget(QLabel("本工具以本地EN文件夹为基准，利用AI优化和修正您上传的目标语言文件夹中的文案。"))
 
         # --- Step 1: Load Base Files ---
-        self.load_status_label = QLabel("正在加载基准文件...")
+        self.load_status_label = QLabel("正在后台加载基准文件...")
         main_layout.addWidget(self.load_status_label)
-        self._load_base_files()
+        self.search_input = QLineEdit()
+        self.search_input.setPlaceholderText("🔍 在全部基准文案中搜索 Key 或文案 (回车)")
+        self.search_input.returnPressed.connect(self.search_base_corpus)
+        self.search_input.setEnabled(False)
+        main_layout.addWidget(self.search_input)
 
         # --- Step 2: Target Language ---
         lang_layout = QHBoxLayout()
@@ -91,30 +374,53 @@ class TranslatorWidget(QWidget):
         main_layout.addWidget(QLabel("<b>2. 上传待优化文件:</b>"))
         self.upload_button = QPushButton("📂 选择待优化的JSON文件...")
         self.upload_button.clicked.connect(self.select_target_files)
+        self.upload_button.setEnabled(False)
         self.upload_status_label = QLabel("尚未选择文件。")
         main_layout.addWidget(self.upload_button)
         main_layout.addWidget(self.upload_status_label)
 
         # --- Step 4: Preview and Run ---
-        main_layout.addWidget(QLabel("<b>3. 预览与执行:</b>"))
+        step3_layout = QHBoxLayout()
+        step3_layout.addWidget(QLabel("<b>3. 预览与执行:</b>"))
+        step3_layout.addStretch()
+        step3_layout.addWidget(QLabel("显示行:"))
+        self.row_filter_selector = QComboBox()
+        self.row_filter_selector.addItems(ROW_FILTERS.keys())
+        self.row_filter_selector.currentTextChanged.connect(self.apply_row_filter)
+        step3_layout.addWidget(self.row_filter_selector)
+        main_layout.addLayout(step3_layout)
         self.preview_selector = QComboBox()
         self.preview_selector.currentTextChanged.connect(self.update_preview)
-        self.preview_table = QTableView()
-        self.preview_table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.preview_table = self._create_table()
         self.run_button = QPushButton("🚀 使用AI批量优化所有匹配的文件")
         self.run_button.clicked.connect(self.run_ai_optimization)
+        self.cancel_button = QPushButton("⏹ 取消")
+        self.cancel_button.clicked.connect(self.cancel_ai_optimization)
+        self.cancel_button.setEnabled(False)
+        self.bypass_cache_checkbox = QCheckBox("本次运行忽略翻译记忆缓存 (重新调用AI)")
+        self.cache_stats_label = QLabel("缓存命中率: -")
         self.run_status = QTextEdit()
         self.run_status.setReadOnly(True)
         self.run_status.setFixedHeight(100)
 
         main_layout.addWidget(self.preview_selector)
         main_layout.addWidget(self.preview_table)
-        main_layout.addWidget(self.run_button)
+        run_layout = QHBoxLayout()
+        run_layout.addWidget(self.bypass_cache_checkbox)
+        run_layout.addStretch()
+        run_layout.addWidget(self.cache_stats_label)
+        main_layout.addLayout(run_layout)
+        run_buttons_layout = QHBoxLayout()
+        run_buttons_layout.addWidget(self.run_button, 1)
+        run_buttons_layout.addWidget(self.cancel_button)
+        main_layout.addLayout(run_buttons_layout)
         main_layout.addWidget(self.run_status)
 
         # --- Step 5: Results ---
         main_layout.addWidget(QLabel("<b>4. 审查并保存结果:</b>"))
         self.results_tabs = QTabWidget()
+        self.results_tabs.currentChanged.connect(self._build_result_tab)
+        self.result_models = {}
         self.save_button = QPushButton("📥 下载包含所有优化后文件的 .zip 包")
         self.save_button.clicked.connect(self.save_results)
         self.save_button.setEnabled(False)
@@ -122,22 +428,40 @@ class TranslatorWidget(QWidget):
         main_layout.addWidget(self.save_button)
 
         self.setLayout(main_layout)
+        self._load_base_files()
 
     def _load_base_files(self):
-        try:
-            base_path = os.path.join(os.path.dirname(__file__), "data", "en")
-            if not os.path.exists(base_path): raise FileNotFoundError(f"基准文件夹 '{base_path}' 不存在。")
-
-            for filename in os.listdir(base_path):
-                if filename.endswith('.json'):
-                    with open(os.path.join(base_path, filename), 'r', encoding='utf-8') as f:
-                        self.base_files_content[filename] = json.load(f)
-
-            if not self.base_files_content: raise ValueError("在基准文件夹中没有找到任何.json文件。")
-            self.load_status_label.setText(f"✅ 已成功加载 {len(self.base_files_content)} 个基准 (EN) 文件！")
-        except Exception as e:
-            self.load_status_label.setText(f"❌ 加载基准文件失败: {e}")
-            QMessageBox.critical(self, "错误", f"加载基准文件失败: {e}")
+        self.loader = BaseIndexLoader()
+        self.loader.finished.connect(self.on_base_files_loaded)
+        self.loader.error.connect(self.on_base_files_error)
+        self.loader.cancelled.connect(lambda: self.load_status_label.setText("⏹ 加载基准文件已取消，重新打开工具以再次加载。"))
+        get_job_manager().submit("文案优化: 加载基准文件", self.loader, "io", PRIORITY_LOW)
+
+    def on_base_files_loaded(self, index, from_cache):
+        self.base_index = index
+        self.base_files_content = index.files
+        source = "索引缓存" if from_cache else "JSON文件"
+        self.load_status_label.setText(f"✅ 已成功加载 {len(index.files)} 个基准 (EN) 文件，共 {len(index)} 条文案 (来自{source})！")
+        self.upload_button.setEnabled(True)
+        self.search_input.setEnabled(True)
+
+    def on_base_files_error(self, msg):
+        self.load_status_label.setText(f"❌ 加载基准文件失败: {msg}")
+        QMessageBox.critical(self, "错误", f"加载基准文件失败: {msg}")
+
+    def search_base_corpus(self):
+        text = self.search_input.text().strip()
+        if not text or self.base_index is None: return
+        matches = self.base_index.search(text)
+        columns = [
+            [filename for filename, _ in matches],
+            [key for _, key in matches],
+            [str(self.base_files_content[filename][key]) for filename, key in matches],
+            [str(len(self.base_index.keys_for_value(str(self.base_files_content[filename][key])))) for filename, key in matches],
+        ]
+        headers = ["文件", "Key", "基准文案 (EN)", "相同文案出现次数"]
+        self._show_model(self.preview_table, ArrayTableModel(headers, columns, original_col=None, compare_col=None, parent=self.preview_table))
+        self.upload_status_label.setText(f"搜索 \"{text}\": 找到 {len(matches)} 条匹配。")
 
     def select_target_files(self):
         files, _ = QFileDialog.getOpenFileNames(self, "选择目标语言的JSON文件", "", "JSON Files (*.json)")
@@ -160,86 +484,135 @@ class TranslatorWidget(QWidget):
         else:
             self.upload_status_label.setText("上传的文件中没有找到与基准文件同名的JSON文件。")
 
+    def _create_table(self):
+        table = QTableView()
+        table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        table.setWordWrap(False)
+        # Fixed row heights and sampled column widths keep layout cost independent of row count
+        table.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        table.horizontalHeader().setResizeContentsPrecision(200)
+        return table
+
+    def _show_model(self, table, model):
+        model.set_filter(ROW_FILTERS[self.row_filter_selector.currentText()])
+        table.setModel(model)
+        table.resizeColumnsToContents()
+
+    def apply_row_filter(self, label):
+        mode = ROW_FILTERS[label]
+        for model in [self.preview_table.model(), *self.result_models.values()]:
+            if isinstance(model, ArrayTableModel): model.set_filter(mode)
+
     def update_preview(self, filename):
         if not filename: return
         base_data = self.base_files_content.get(filename, {})
         target_data = self.target_files_content.get(filename, {})
 
-        df = pd.DataFrame([
-            {"Key": key, "基准文案 (EN)": base_value, f"当前文案 ({self.target_lang_input.text()})": target_data.get(key, "【缺失】")}
-            for key, base_value in base_data.items()
-        ])
-
-        model = QStandardItemModel(df.shape[0], df.shape[1])
-        model.setHorizontalHeaderLabels(df.columns)
-        for row in range(df.shape[0]):
-            for col in range(df.shape[1]):
-                model.setItem(row, col, QStandardItem(str(df.iloc[row, col])))
-        self.preview_table.setModel(model)
-        self.preview_table.resizeColumnsToContents()
+        keys = list(base_data.keys())
+        columns = [
+            keys,
+            [str(base_data[key]) for key in keys],
+            [str(target_data.get(key, MISSING)) for key in keys],
+        ]
+        headers = ["Key", "基准文案 (EN)", f"当前文案 ({self.target_lang_input.text()})"]
+        # In the preview "changed" / "identical" compare the current translation against the EN text
+        self._show_model(self.preview_table, ArrayTableModel(headers, columns, original_col=2, compare_col=1, parent=self.preview_table))
 
     def run_ai_optimization(self):
         if not self.target_files_content:
             QMessageBox.warning(self, "提示", "请先选择要优化的文件。"); return
 
         self.run_button.setEnabled(False)
+        self.cancel_button.setEnabled(True)
         self.run_status.setText("正在准备调用AI...")
+        self.cache_stats_label.setText("缓存命中率: -")
+        self.ai_results = {}
+        self.result_models = {}
+        self.results_tabs.clear()
+        self.save_button.setEnabled(False)
 
         model = "llama3.1:latest"
         if self.main_window and hasattr(self.main_window, 'get_selected_model'):
             model = self.main_window.get_selected_model()
         self.run_status.append(f"使用模型: {model}")
 
-        self.thread = QThread()
-        self.worker = TranslatorWorker(model, self.base_files_content, self.target_files_content, self.target_lang_input.text())
-        self.worker.moveToThread(self.thread)
+        self.worker = TranslatorWorker(model, self.base_files_content, self.target_files_content, self.target_lang_input.text(),
+                                       use_cache=not self.bypass_cache_checkbox.isChecked())
         self.worker.progress.connect(lambda msg: self.run_status.append(msg))
+        self.worker.cache_stats.connect(self.update_cache_stats)
+        self.worker.file_finished.connect(self.on_file_finished)
         self.worker.error.connect(self.on_ai_error)
+        self.worker.cancelled.connect(self.on_ai_cancelled)
         self.worker.finished.connect(self.on_ai_finished)
-        self.worker.finished.connect(self.thread.quit)
-        self.worker.finished.connect(self.worker.deleteLater)
-        self.thread.finished.connect(self.thread.deleteLater)
-        self.thread.started.connect(self.worker.run)
-        self.thread.start()
+        get_job_manager().submit(f"文案优化: {model}", self.worker, "io", PRIORITY_NORMAL)
+
+    def update_cache_stats(self, hits, total):
+        rate = hits / total * 100 if total else 0.0
+        self.cache_stats_label.setText(f"缓存命中率: {rate:.1f}% ({hits}/{total})")
+
+    def cancel_ai_optimization(self):
+        if getattr(self, 'worker', None) is None: return
+        self.cancel_button.setEnabled(False)
+        self.run_status.append("正在取消，当前请求完成后停止...")
+        self.worker.cancel()
+
+    def on_file_finished(self, filename, optimized_data):
+        self.ai_results[filename] = optimized_data
+        self.save_button.setEnabled(True)
+        self.display_results(filename)
+
+    def on_ai_cancelled(self):
+        self.worker = None
+        self.run_button.setEnabled(True)
+        self.cancel_button.setEnabled(False)
+        self.run_status.append("⏹ 已取消。进度已保存，再次运行将从断点继续。")
 
     def on_ai_error(self, msg):
+        self.worker = None
         self.run_button.setEnabled(True)
+        self.cancel_button.setEnabled(False)
         self.run_status.append(f"错误: {msg}")
+        self.run_status.append("进度已保存，再次运行将从断点继续。")
         QMessageBox.critical(self, "AI处理出错", msg)
 
     def on_ai_finished(self, results):
+        self.worker = None
         self.run_button.setEnabled(True)
+        self.cancel_button.setEnabled(False)
         self.run_status.append("✅ AI优化完成！请在下方审查结果。")
         self.ai_results = results
-        self.save_button.setEnabled(True)
-        self.display_results()
+        self.save_button.setEnabled(bool(results))
+
+    def display_results(self, filename):
+        # Only an empty page is added here; the table is built the first time the tab is opened
+        tab = QWidget()
+        QVBoxLayout(tab)
+        self.results_tabs.addTab(tab, filename)
+
+    def _build_result_tab(self, index):
+        if index < 0: return
+        filename = self.results_tabs.tabText(index)
+        if filename in self.result_models or filename not in self.ai_results: return
+        optimized_data = self.ai_results[filename]
+        base_data = self.base_files_content.get(filename, {})
+        target_data = self.target_files_content.get(filename, {})
 
-    def display_results(self):
-        self.results_tabs.clear()
-        for filename, optimized_data in self.ai_results.items():
-            tab = QWidget()
-            layout = QVBoxLayout(tab)
-            table = QTableView()
-            table.setEditTriggers(QAbstractItemView.NoEditTriggers)
-            layout.addWidget(table)
-
-            base_data = self.base_files_content.get(filename, {})
-            target_data = self.target_files_content.get(filename, {})
-
-            df = pd.DataFrame([{
-                "Key": key, "基准 (EN)": base_value,
-                f"原始 ({self.target_lang_input.text()})": target_data.get(key, "【缺失】"),
-                f"AI优化后 ({self.target_lang_input.text()})": optimized_data.get(key)
-            } for key, base_value in base_data.items()])
-
-            model = QStandardItemModel(df.shape[0], df.shape[1])
-            model.setHorizontalHeaderLabels(df.columns)
-            for row in range(df.shape[0]):
-                for col in range(df.shape[1]):
-                    model.setItem(row, col, QStandardItem(str(df.iloc[row, col])))
-            table.setModel(model)
-            table.resizeColumnsToContents()
-            self.results_tabs.addTab(tab, filename)
+        keys = list(base_data.keys())
+        columns = [
+            keys,
+            [str(base_data[key]) for key in keys],
+            [str(target_data.get(key, MISSING)) for key in keys],
+            [str(optimized_data.get(key)) for key in keys],
+        ]
+        lang = self.target_lang_input.text()
+        headers = ["Key", "基准 (EN)", f"原始 ({lang})", f"AI优化后 ({lang})"]
+
+        tab = self.results_tabs.widget(index)
+        table = self._create_table()
+        tab.layout().addWidget(table)
+        model = ArrayTableModel(headers, columns, original_col=2, compare_col=3, parent=table)
+        self.result_models[filename] = model
+        self._show_model(table, model)
 
     def save_results(self):
         if not self.ai_results: return
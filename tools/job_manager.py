@@ -0,0 +1,209 @@
+import os, time, threading, itertools
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from PySide6.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout, QTableWidget, QTableWidgetItem, QPushButton, QLabel, QHeaderView, QAbstractItemView
+from PySide6.QtCore import QObject, QRunnable, QThreadPool, QTimer, Signal
+from tools.perf import metrics
+
+CPU_WORKERS = os.cpu_count() or 4
+IO_WORKERS = 16
+MAX_CONCURRENT_JOBS = 4
+# Jobs run in lanes with their own slots, so long batch jobs cannot hold up the others
+LANE_BATCH, LANE_INTERACTIVE, LANE_WARMUP = "batch", "interactive", "warmup"
+INTERACTIVE_JOBS = 2  # reserved for latency-sensitive jobs such as chat replies
+LANE_SLOTS = {LANE_BATCH: MAX_CONCURRENT_JOBS, LANE_INTERACTIVE: INTERACTIVE_JOBS, LANE_WARMUP: 1}
+KEEP_FINISHED_JOBS = 50
+PRIORITY_LOW, PRIORITY_NORMAL, PRIORITY_HIGH = 0, 5, 10
+STATE_QUEUED, STATE_RUNNING, STATE_DONE, STATE_CANCELLED, STATE_FAILED = "排队中", "运行中", "完成", "已取消", "失败"
+
+class JobWorker(QObject):
+    """Base class for tool workers run by the JobManager. Subclasses implement run(), check
+    is_cancelled() between units of work and call report() to feed the jobs panel.
+    `cancelled` is emitted when a queued job is cancelled before run() starts, so the owning widget
+    is always told how the job ended; workers may emit it from their own cancel path as well."""
+    cancelled = Signal()
+
+    def __init__(self):
+        super().__init__()
+        self.job = None
+        self._cancelled = False
+
+    def cancel(self): self._cancelled = True
+    def is_cancelled(self): return self._cancelled
+
+    def report(self, done, total=None):
+        if self.job: self.job.update(done, total)
+
+class Job(QRunnable):
+    _ids = itertools.count(1)
+
+    def __init__(self, manager, name, worker, kind, priority, lane=LANE_BATCH):
+        super().__init__()
+        self.setAutoDelete(False)
+        self.id = next(Job._ids)
+        self.manager = manager
+        self.name = name
+        self.worker = worker
+        self.kind = kind
+        self.priority = priority
+        self.lane = lane
+        self.state = STATE_QUEUED
+        self.created_at = time.monotonic()
+        self.started_at = self.ended_at = None
+        self.done, self.total = 0, None
+
+    def run(self):
+        self.state = STATE_RUNNING
+        self.started_at = time.monotonic()
+        try:
+            # Every job is a span in the perf log; with profiling switched on it also gets a .prof file
+            with metrics.span(f"job.{self.kind}", job=self.name):
+                metrics.run_profiled(f"job{self.id}_{self.name}", self.worker.run)
+            self.state = STATE_CANCELLED if self.worker.is_cancelled() else STATE_DONE
+        except Exception:
+            self.state = STATE_FAILED
+        finally:
+            self.ended_at = time.monotonic()
+            self.manager._job_finished(self)
+
+    def update(self, done, total=None):
+        self.done = done
+        if total is not None: self.total = total
+
+    def cancel(self):
+        self.worker.cancel()
+        if self.state == STATE_QUEUED and self.manager.pools[self.lane].tryTake(self):
+            self.state = STATE_CANCELLED
+            self.ended_at = time.monotonic()
+            self.manager._job_finished(self)
+            self.worker.cancelled.emit()
+
+    @property
+    def elapsed(self):
+        if self.started_at is None: return 0.0
+        return (self.ended_at or time.monotonic()) - self.started_at
+
+    @property
+    def throughput(self): return self.done / self.elapsed if self.elapsed > 0 else 0.0
+
+class JobManager(QObject):
+    """App-wide scheduler: each lane runs at most LANE_SLOTS[lane] jobs at once, highest priority first, and the
+    jobs share one CPU pool and one I/O pool for their inner tasks instead of each starting its own."""
+    changed = Signal()
+
+    def __init__(self, lane_slots=LANE_SLOTS, cpu_workers=CPU_WORKERS, io_workers=IO_WORKERS):
+        super().__init__()
+        self.pools = {}
+        for lane, slots in lane_slots.items():
+            self.pools[lane] = QThreadPool()
+            self.pools[lane].setMaxThreadCount(slots)
+        self.cpu_executor = ThreadPoolExecutor(max_workers=cpu_workers, thread_name_prefix="cpu")
+        self.io_executor = ThreadPoolExecutor(max_workers=io_workers, thread_name_prefix="io")
+        self.jobs = []
+        self._lock = threading.Lock()
+
+    def executor(self, kind): return self.cpu_executor if kind == "cpu" else self.io_executor
+
+    def submit(self, name, worker, kind="io", priority=PRIORITY_NORMAL, lane=LANE_BATCH):
+        job = Job(self, name, worker, kind, priority, lane)
+        worker.job = job
+        with self._lock:
+            self.jobs.append(job)
+            self._prune()
+        self.pools[lane].start(job, priority)
+        self.changed.emit()
+        return job
+
+    def _prune(self):
+        finished = [j for j in self.jobs if j.ended_at is not None]
+        for job in finished[:max(0, len(finished) - KEEP_FINISHED_JOBS)]: self.jobs.remove(job)
+
+    def _job_finished(self, job):
+        with self._lock: self._prune()
+        self.changed.emit()
+
+    def snapshot(self):
+        with self._lock: return list(self.jobs)
+
+    def active_jobs(self): return [j for j in self.snapshot() if j.ended_at is None]
+
+    def shutdown(self, timeout_ms=5000):
+        for job in self.active_jobs(): job.cancel()
+        for pool in self.pools.values(): pool.waitForDone(timeout_ms)
+        self.cpu_executor.shutdown(wait=False, cancel_futures=True)
+        self.io_executor.shutdown(wait=False, cancel_futures=True)
+
+def run_bounded(executor, fn, arg_tuples, limit, is_cancelled=None):
+    """Runs fn(*args) for each tuple on a shared executor with at most `limit` in flight, so one job cannot
+    flood the pool. Yields (args, future) as they complete; stops submitting once is_cancelled() is true."""
+    pending, in_flight = iter(arg_tuples), {}
+    def fill():
+        while len(in_flight) < limit and not (is_cancelled and is_cancelled()):
+            args = next(pending, None)
+            if args is None: return
+            in_flight[executor.submit(fn, *args)] = args
+    try:
+        fill()
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done: yield in_flight.pop(future), future
+            fill()
+    finally:
+        for future in in_flight: future.cancel()
+
+_manager = None
+_manager_lock = threading.Lock()
+
+def get_job_manager():
+    global _manager
+    with _manager_lock:
+        if _manager is None: _manager = JobManager()
+        return _manager
+
+class JobPanel(QWidget):
+    HEADERS = ["#", "任务", "池", "优先级", "状态", "进度", "耗时", "吞吐 (项/s)"]
+
+    def __init__(self, manager=None, parent=None):
+        super().__init__(parent)
+        self.manager = manager or get_job_manager()
+        layout = QVBoxLayout(self)
+        layout.setContentsMargins(5, 5, 5, 5)
+
+        header_layout = QHBoxLayout()
+        self.summary_label = QLabel()
+        self.cancel_button = QPushButton("⏹ 取消选中任务")
+        self.cancel_button.clicked.connect(self.cancel_selected)
+        header_layout.addWidget(self.summary_label, 1)
+        header_layout.addWidget(self.cancel_button)
+        layout.addLayout(header_layout)
+
+        self.table = QTableWidget(0, len(self.HEADERS))
+        self.table.setHorizontalHeaderLabels(self.HEADERS)
+        self.table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.table.verticalHeader().setVisible(False)
+        self.table.horizontalHeader().setSectionResizeMode(1, QHeaderView.Stretch)
+        layout.addWidget(self.table)
+
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.refresh)
+        self.timer.start(500)
+        self.manager.changed.connect(self.refresh)
+        self.refresh()
+
+    def refresh(self):
+        if not self.isVisible(): return
+        jobs = self.manager.snapshot()[::-1]
+        self.table.setRowCount(len(jobs))
+        for row, job in enumerate(jobs):
+            progress = f"{job.done}/{job.total}" if job.total else str(job.done or "-")
+            values = [job.id, job.name, job.kind, job.priority, job.state, progress, f"{job.elapsed:.1f}s", f"{job.throughput:.1f}" if job.done else "-"]
+            for col, value in enumerate(values): self.table.setItem(row, col, QTableWidgetItem(str(value)))
+        running = sum(1 for j in jobs if j.state == STATE_RUNNING)
+        queued = sum(1 for j in jobs if j.state == STATE_QUEUED)
+        self.summary_label.setText(f"运行中 {running} · 排队 {queued} · CPU池 {self.manager.cpu_executor._max_workers} 线程 · I/O池 {self.manager.io_executor._max_workers} 线程")
+
+    def cancel_selected(self):
+        selected_ids = {int(self.table.item(index.row(), 0).text()) for index in self.table.selectionModel().selectedRows()}
+        for job in self.manager.snapshot():
+            if job.id in selected_ids: job.cancel()
+        self.refresh()
@@ -0,0 +1,177 @@
+import os, time, threading, itertools, requests
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from contextlib import contextmanager
+from requests.adapters import HTTPAdapter
+from tools.perf import span
+
+# Comma separated base URLs, e.g. OLLAMA_ENDPOINTS=http://localhost:11434,http://localhost:11435
+ENDPOINTS_ENV = "OLLAMA_ENDPOINTS"
+DEFAULT_ENDPOINTS = ["http://localhost:11434"]
+PER_ENDPOINT_CONCURRENCY = 2
+HEALTH_CHECK_TIMEOUT = 2
+RETRY_FAILED_AFTER = 30  # seconds before a failed endpoint is health-checked again
+DEFAULT_KEEP_ALIVE = "30m"  # how long Ollama keeps a model loaded after the last request
+LATENCY_SAMPLES = 200  # per-model latencies kept for the metrics
+WARM_UP_TIMEOUT = 60  # Ollama keeps loading after a timeout; the warm-up just stops waiting for it
+
+def configured_endpoints():
+    urls = [u.strip().rstrip('/') for u in os.environ.get(ENDPOINTS_ENV, "").split(',') if u.strip()]
+    return urls or list(DEFAULT_ENDPOINTS)
+
+class NoHealthyEndpointError(requests.exceptions.ConnectionError):
+    pass
+
+class Endpoint:
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+        self.session = requests.Session()
+        # Reuse keep-alive connections for every concurrent request the pool may send to this endpoint
+        self.session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=PER_ENDPOINT_CONCURRENCY * 4))
+        self.session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=PER_ENDPOINT_CONCURRENCY * 4))
+        self.outstanding = 0
+        self.healthy = True
+        self.failures = 0
+        self.retry_at = 0.0
+
+class EndpointPool:
+    """Ollama servers behind one interface: least-outstanding-requests routing, health checks and failover.
+
+    Connection errors, timeouts and 5xx answers mark an endpoint as failed and the request moves on to the
+    next one. Failed endpoints are skipped until RETRY_FAILED_AFTER has passed and a health check succeeds.
+    """
+    def __init__(self, urls=None, per_endpoint_concurrency=PER_ENDPOINT_CONCURRENCY):
+        self.endpoints = [Endpoint(u) for u in (urls or configured_endpoints())]
+        self.per_endpoint_concurrency = per_endpoint_concurrency
+        self._lock = threading.Lock()
+        self._round_robin = itertools.count()
+
+    @property
+    def capacity(self): return len(self.endpoints) * self.per_endpoint_concurrency
+
+    def _mark(self, endpoint, ok):
+        with self._lock:
+            if ok:
+                endpoint.healthy, endpoint.failures = True, 0
+            else:
+                endpoint.healthy, endpoint.failures = False, endpoint.failures + 1
+                endpoint.retry_at = time.monotonic() + RETRY_FAILED_AFTER
+
+    def check_health(self, endpoint):
+        try:
+            ok = endpoint.session.get(f"{endpoint.url}/api/tags", timeout=HEALTH_CHECK_TIMEOUT).status_code == 200
+        except requests.exceptions.RequestException:
+            ok = False
+        self._mark(endpoint, ok)
+        return ok
+
+    def _route(self):
+        with self._lock:
+            start, n = next(self._round_robin), len(self.endpoints)
+            rotated = [self.endpoints[(start + i) % n] for i in range(n)]
+            # sorted() is stable, so endpoints with equal load keep the round-robin order
+            healthy = sorted((e for e in rotated if e.healthy), key=lambda e: e.outstanding)
+            now = time.monotonic()
+            due = [e for e in rotated if not e.healthy and e.retry_at <= now]
+        healthy += [e for e in due if self.check_health(e)]
+        # With nothing known to be healthy, still try everything once rather than failing outright
+        return healthy or rotated
+
+    @contextmanager
+    def request(self, path, payload, timeout=120, stream=False):
+        errors = []
+        for endpoint in self._route():
+            with self._lock: endpoint.outstanding += 1
+            try:
+                try:
+                    response = endpoint.session.post(endpoint.url + path, json=payload, timeout=timeout, stream=stream)
+                    if response.status_code >= 500: response.raise_for_status()
+                except requests.exceptions.RequestException as e:
+                    self._mark(endpoint, False)
+                    errors.append(f"{endpoint.url}: {e}")
+                    continue
+                self._mark(endpoint, True)
+                try:
+                    yield response
+                finally:
+                    response.close()
+                return
+            finally:
+                with self._lock: endpoint.outstanding -= 1
+        raise NoHealthyEndpointError("所有LLM端点均不可用: " + "; ".join(errors))
+
+    def chat(self, payload, timeout=120):
+        with self.request("/api/chat", payload, timeout=timeout) as response:
+            response.raise_for_status()
+            return response.json()
+
+    def status(self):
+        with self._lock:
+            return [{"url": e.url, "healthy": e.healthy, "outstanding": e.outstanding, "failures": e.failures} for e in self.endpoints]
+
+class LLMClient:
+    """The one LLM client shared by all tools: endpoint pool, keep_alive pinning, warm-up and per-model latency."""
+    def __init__(self, pool=None, keep_alive=DEFAULT_KEEP_ALIVE):
+        self.pool = pool or EndpointPool()
+        self.keep_alive = keep_alive
+        self._latencies = {}  # model -> deque of seconds
+        self._lock = threading.Lock()
+
+    def record(self, model, seconds):
+        with self._lock:
+            self._latencies.setdefault(model, deque(maxlen=LATENCY_SAMPLES)).append(seconds)
+
+    def metrics(self):
+        with self._lock: samples = {model: sorted(values) for model, values in self._latencies.items() if values}
+        return {
+            model: {"count": len(v), "avg": sum(v) / len(v), "p50": v[len(v) // 2], "p95": v[min(len(v) - 1, int(len(v) * 0.95))], "max": v[-1]}
+            for model, v in samples.items()
+        }
+
+    def _payload(self, model, messages, stream, extra):
+        return {"model": model, "messages": messages, "stream": stream, "keep_alive": self.keep_alive, **extra}
+
+    # `tool` only labels the perf span so LLM time can be told apart per tool
+    def chat(self, model, messages, timeout=120, tool=None, **extra):
+        started = time.perf_counter()
+        with span("llm.request", model=model, tool=tool):
+            response_data = self.pool.chat(self._payload(model, messages, False, extra), timeout=timeout)
+        self.record(model, time.perf_counter() - started)
+        return response_data
+
+    @contextmanager
+    def stream_chat(self, model, messages, timeout=120, tool=None, **extra):
+        # For streams the recorded latency is the time until the server starts answering
+        started = time.perf_counter()
+        with span("llm.stream", model=model, tool=tool):
+            with self.pool.request("/api/chat", self._payload(model, messages, True, extra), timeout=timeout, stream=True) as response:
+                self.record(model, time.perf_counter() - started)
+                yield response
+
+    def warm_up(self, model, timeout=WARM_UP_TIMEOUT, keep_alive=None):
+        """Loads `model` on every reachable endpoint in parallel and pins it for keep_alive (or the given value).
+        Returns the slowest load time."""
+        extra = {} if keep_alive is None else {"keep_alive": keep_alive}
+        def load(endpoint):
+            started = time.perf_counter()
+            try:
+                # A chat request without messages only loads the model
+                response = endpoint.session.post(f"{endpoint.url}/api/chat", json=self._payload(model, [], False, extra), timeout=timeout)
+                response.raise_for_status()
+            except requests.exceptions.RequestException as e:
+                return None, f"{endpoint.url}: {e}"
+            return time.perf_counter() - started, None
+        with ThreadPoolExecutor(max_workers=len(self.pool.endpoints)) as executor:
+            results = list(executor.map(load, self.pool.endpoints))
+        loaded = [seconds for seconds, _ in results if seconds is not None]
+        if not loaded: raise NoHealthyEndpointError("预热失败: " + "; ".join(error for _, error in results))
+        return max(loaded)
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    global _client
+    with _client_lock:
+        if _client is None: _client = LLMClient()
+        return _client
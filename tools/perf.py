@@ -0,0 +1,153 @@
+import os, json, time, threading, cProfile
+from collections import deque
+from contextlib import contextmanager
+from PySide6.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout, QTableWidget, QTableWidgetItem, QLabel, QCheckBox, QHeaderView, QAbstractItemView
+from PySide6.QtCore import QTimer
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PERF_LOG_PATH = os.path.join(ROOT_DIR, "perf_metrics.jsonl")
+PROFILE_DIR = os.path.join(ROOT_DIR, "profiles")
+HISTOGRAM_SAMPLES = 1000  # most recent observations kept per histogram for percentiles
+PERF_LOG_MAX_BYTES = 20 * 1024 * 1024  # the log is rotated to <path>.1 past this size, so at most two files are kept
+
+class Histogram:
+    def __init__(self):
+        self.samples = deque(maxlen=HISTOGRAM_SAMPLES)
+        self.count, self.total, self.max = 0, 0.0, 0.0
+
+    def observe(self, value):
+        self.samples.append(value)
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def summary(self):
+        ordered = sorted(self.samples)
+        pick = lambda q: ordered[min(len(ordered) - 1, int(len(ordered) * q))] if ordered else 0.0
+        return {"count": self.count, "avg": self.total / self.count if self.count else 0.0, "p50": pick(0.5), "p95": pick(0.95), "max": self.max}
+
+class Metrics:
+    """Process-wide spans, counters and histograms. Spans are appended to a JSON-lines file as they finish
+    unless opened with record=False (hot per-item spans only feed their histogram); counters and histogram
+    summaries are written as a snapshot record on flush()."""
+    def __init__(self, log_path=PERF_LOG_PATH):
+        self.log_path = log_path
+        self.counters = {}
+        self.histograms = {}
+        self.profile_jobs = False
+        self._lock = threading.Lock()
+        self._log = None
+        self._log_bytes = 0
+
+    def _write(self, record):
+        line = json.dumps(record, ensure_ascii=False, default=str) + "\n"
+        with self._lock:
+            try:
+                if self._log is not None and self._log_bytes >= PERF_LOG_MAX_BYTES:
+                    self._log.close()
+                    self._log = None
+                    os.replace(self.log_path, self.log_path + ".1")
+                if self._log is None:
+                    self._log = open(self.log_path, 'a', encoding='utf-8', buffering=1 << 16)
+                    self._log_bytes = self._log.tell()
+                self._log.write(line)
+                self._log_bytes += len(line)  # characters, close enough to bytes for a size cap
+            except OSError:
+                pass
+
+    def inc(self, name, value=1):
+        with self._lock: self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name, value):
+        with self._lock: self.histograms.setdefault(name, Histogram()).observe(value)
+
+    @contextmanager
+    def span(self, name, record=True, **attrs):
+        started = time.perf_counter()
+        status = "ok"
+        try:
+            yield attrs
+        except BaseException:
+            status = "error"
+            raise
+        finally:
+            seconds = time.perf_counter() - started
+            self.observe(name, seconds)
+            if record: self._write({"type": "span", "name": name, "ts": time.time(), "ms": round(seconds * 1000, 3),
+                         "status": status, "thread": threading.current_thread().name, **attrs})
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.counters), {name: h.summary() for name, h in self.histograms.items()}
+
+    def flush(self):
+        counters, histograms = self.snapshot()
+        self._write({"type": "snapshot", "ts": time.time(), "counters": counters, "histograms": histograms})
+        with self._lock:
+            if self._log: self._log.flush()
+
+    def run_profiled(self, name, fn):
+        """Runs fn() under cProfile when profile_jobs is on and writes <PROFILE_DIR>/<name>_<time>.prof.
+        Only the calling thread is profiled, not tasks it hands to the shared pools."""
+        if not self.profile_jobs: return fn()
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            return fn()  # Python 3.12+ allows one active profiler; concurrent jobs then run unprofiled
+        try:
+            return fn()
+        finally:
+            profiler.disable()
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            safe_name = "".join(c if c.isalnum() or c in "-_" else "_" for c in name)
+            path = os.path.join(PROFILE_DIR, f"{safe_name}_{time.strftime('%Y%m%d_%H%M%S')}.prof")
+            profiler.dump_stats(path)
+            self._write({"type": "profile", "name": name, "ts": time.time(), "path": path})
+
+metrics = Metrics()
+span, inc, observe = metrics.span, metrics.inc, metrics.observe
+
+class PerfPanel(QWidget):
+    HEADERS = ["指标", "次数", "平均 (ms)", "p50 (ms)", "p95 (ms)", "最大 (ms)"]
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        layout = QVBoxLayout(self)
+        layout.setContentsMargins(5, 5, 5, 5)
+
+        header_layout = QHBoxLayout()
+        self.profile_checkbox = QCheckBox("为后台任务采集 cProfile")
+        self.profile_checkbox.setToolTip(f"每个任务的 .prof 文件保存在 {PROFILE_DIR}")
+        self.profile_checkbox.toggled.connect(lambda checked: setattr(metrics, 'profile_jobs', checked))
+        header_layout.addWidget(self.profile_checkbox)
+        header_layout.addStretch()
+        header_layout.addWidget(QLabel(f"日志: {os.path.basename(metrics.log_path)}"))
+        layout.addLayout(header_layout)
+
+        self.table = QTableWidget(0, len(self.HEADERS))
+        self.table.setHorizontalHeaderLabels(self.HEADERS)
+        self.table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.table.verticalHeader().setVisible(False)
+        self.table.horizontalHeader().setSectionResizeMode(0, QHeaderView.Stretch)
+        layout.addWidget(self.table)
+        self.counters_label = QLabel()
+        self.counters_label.setWordWrap(True)
+        layout.addWidget(self.counters_label)
+
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.refresh)
+        self.timer.start(1000)
+        # The snapshot record is cheap; writing it every 30 s keeps the log useful after a crash
+        self.flush_timer = QTimer(self)
+        self.flush_timer.timeout.connect(metrics.flush)
+        self.flush_timer.start(30000)
+
+    def refresh(self):
+        if not self.isVisible(): return
+        counters, histograms = metrics.snapshot()
+        self.table.setRowCount(len(histograms))
+        for row, (name, h) in enumerate(sorted(histograms.items())):
+            values = [name, h["count"], *(f"{h[k] * 1000:.1f}" for k in ("avg", "p50", "p95", "max"))]
+            for col, value in enumerate(values): self.table.setItem(row, col, QTableWidgetItem(str(value)))
+        self.counters_label.setText(" · ".join(f"{name}: {value}" for name, value in sorted(counters.items())))